@@ -4,13 +4,14 @@ import logging
 from io import BytesIO
 
 import base64
-import boto3
+import json
+
 import cv2
 
 from dotenv import load_dotenv
 from flask import jsonify
 from flask_security import (
-    roles_required, SQLAlchemyUserDatastore, Security, current_user, login_user, url_for_security, roles_accepted
+    roles_required, Security, current_user, login_user, url_for_security, roles_accepted
 )
 from werkzeug.security import generate_password_hash
 from flask_security.signals import user_registered
@@ -18,12 +19,20 @@ from flask_security.signals import user_registered
 import numpy as np
 from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
 
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, Response, render_template, redirect, url_for, flash, request, send_file, stream_with_context
 from flask_migrate import Migrate
-from aws_utils import upload_file_to_s3, download_file_from_s3, delete_file_from_s3
+from aws_utils import create_s3_client, upload_file_to_s3, download_file_from_s3, file_exists_in_s3
 from config import Config
-from models import db, Image, ImageSegment, AppUser, Role, init_roles  # Import db and Image from models.py
-from utils import create_segmentation_layer, create_rgba_image, combine_two_images
+from export import build_export, cache_stream, expire_cached_exports, export_cache_key, stream_zip
+from identity_cache import CachingUserDatastore
+from inference import AdmissionController, AdmissionRejected, InferenceExecutor
+from model_artifacts import ModelArtifactManager, load_manifest
+from model_pool import ModelPool, ModelPoolExhausted, ModelTooLarge
+from models import db, Image, ImageSegment, AppUser, Role, IdentityVersion, init_roles  # Import db and Image from models.py
+from utils import (
+    create_segmentation_layer, create_rgba_image, combine_two_images, read_image_dimensions, create_label_overlay,
+    encode_label_overlay, render_composite, composite_filename, is_composite_at, opacity_percent
+)
 from werkzeug.security import check_password_hash
 
 # add logger
@@ -38,40 +47,23 @@ app.config.from_object(Config)
 db.init_app(app)  # Initialize db with the app
 migrate = Migrate(app, db)
 
-user_datastore = SQLAlchemyUserDatastore(db, AppUser, Role)
+user_datastore = CachingUserDatastore(db, AppUser, Role, IdentityVersion, ttl=app.config['IDENTITY_CACHE_TTL'],
+                                      check_interval=app.config['IDENTITY_CACHE_CHECK_INTERVAL'])
 security = Security(app, user_datastore)
 
-s3_client = boto3.client('s3',
-                         aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-                         aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-                         region_name='us-east-1')
-
+s3_client = create_s3_client(app.config['S3_REGION'])
 
-def download_model():
-    """Download the model from S3 if it does not exist locally."""
-    logging.info("Downloading model")
-    this_path = os.path.dirname(os.path.abspath(__file__))
-    ai_model_path = os.path.join(this_path, 'ai_model')
-    object_key = 'sam_vit_b_01ec64.pth'
 
-    # check if the model already exists
-    if os.path.exists(os.path.join(ai_model_path, object_key)):
-        logging.info("Model already exists")
-    else:
-        logging.info("Model does not exist")
-        # Ensure the AI model directory exists
-        os.makedirs(ai_model_path, exist_ok=True)
-        download_path = os.path.join(ai_model_path, 'sam_vit_b_01ec64.pth')
-
-        try:
-            s3_client.download_file(app.config['BUCKET_NAME'], object_key, download_path)
-            logging.info("Model downloaded successfully")
-        except Exception as e:
-            logging.error(f"Failed to download model: {e}")
-
-
-# Download the model file
-download_model()
+this_path = os.path.dirname(os.path.abspath(__file__))
+model_artifacts = ModelArtifactManager(
+    s3_client,
+    app.config['BUCKET_NAME'],
+    os.path.join(this_path, app.config['MODEL_CACHE_DIR']),
+    load_manifest(os.path.join(this_path, app.config['MODEL_MANIFEST_PATH'])),
+    workers=app.config['MODEL_DOWNLOAD_WORKERS'],
+    chunk_size=app.config['MODEL_DOWNLOAD_CHUNK_MB'] * 1024 ** 2,
+    allow_unpinned=app.config['MODEL_ALLOW_UNPINNED'],
+)
 
 # Initialize roles
 with app.app_context():
@@ -83,16 +75,105 @@ with app.app_context():
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
 
-# Initialize SAM model
-sam_model = sam_model_registry[app.config['MODEL_TYPE']](checkpoint=app.config['CHECKPOINT_PATH'])
-mask_generator = SamAutomaticMaskGenerator(sam_model)
+inference_executor = InferenceExecutor(max_workers=app.config['INFERENCE_WORKERS'])
+
+
+def _load_sam_model(name):
+    checkpoint_path = model_artifacts.ensure(name)
+    sam_model = sam_model_registry[model_artifacts.entry(name)['model_type']](checkpoint=checkpoint_path)
+    size = sum(p.numel() * p.element_size() for p in sam_model.parameters())
+    return SamAutomaticMaskGenerator(sam_model, points_per_batch=app.config['INFERENCE_POINTS_PER_BATCH']), size
+
+
+def load_sam_model(name):
+    """Download, verify and load a SAM checkpoint, returning its mask generator and size in bytes."""
+    # Deserializing the weights is CPU-bound, so it runs off the event loop like inference
+    return inference_executor.run(_load_sam_model, name)
+
+
+def estimate_sam_model(name):
+    """Estimate the resident size of a model from its checkpoint, which holds the fp32 weights."""
+    # Only the recorded size, so the request never waits on a download; load_sam_model fetches the file
+    return model_artifacts.size(name)
+
+
+# Decoding, labelling, blending and encoding take up to a second on a 12 MP image, so like the model
+# they run on the inference executor instead of holding the event loop
+def decode_image_rgb(file_data):
+    """Decode an uploaded image to RGB (OpenCV loads in BGR), or return None if it cannot be read."""
+    image = cv2.imdecode(np.frombuffer(file_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def render_segmentation(masks_info, image_rgb):
+    """Encode the masks in the configured output mode, returning the image and the overlay palette (None for composites)."""
+    if app.config['SEGMENTATION_OUTPUT'] == 'overlay':
+        # Store only the labels; the browser composites them over the original
+        labels, palette = create_label_overlay(masks_info, image_rgb.shape)
+        logging.info("Label overlay generated successfully")
+        return encode_label_overlay(labels, palette, app.config['OVERLAY_FORMAT']), palette
+
+    # Generate the combined image with annotations
+    masked_image = create_segmentation_layer(masks_info, image_rgb)
+    logging.info("Masked image generated successfully")
+    combined_image = combine_two_images(create_rgba_image(image_rgb), masked_image, alpha=app.config['OVERLAY_OPACITY'])
+    _, img_encoded = cv2.imencode('.jpg', cv2.cvtColor(combined_image, cv2.COLOR_RGB2BGR))
+    return BytesIO(img_encoded), None
+
+
+def render_composite_off_loop(original, overlay, alpha):
+    """Blend an original with its label overlay on the inference executor."""
+    return inference_executor.run(render_composite, original, overlay, alpha=alpha)
+
+
+# Initialize SAM models, loading the default one up front
+model_pool = ModelPool(load_sam_model, estimate_sam_model, app.config['MODEL_POOL_MEMORY_MB'] * 1024 ** 2,
+                       wait_timeout=app.config['MODEL_POOL_WAIT_TIMEOUT'])
+
+
+def is_model_available(name):
+    """Return whether a model's checkpoint can be reached and fits in the pool, which could never load it otherwise."""
+    try:
+        size = estimate_sam_model(name)
+    except Exception as e:
+        logging.error("Model %s is unavailable: %s", name, e)
+        return False
+    if size > model_pool.memory_budget:
+        logging.warning("Model %s (%d bytes) does not fit in the model memory budget", name, size)
+        return False
+    return True
+
+
+available_models = [name for name in model_artifacts.manifest if is_model_available(name)]
+with model_pool.acquire(app.config['MODEL_NAME']):
+    pass
+
+# The inference limits are for the whole host, so each worker process enforces its share
+web_concurrency = app.config['WEB_CONCURRENCY']
+if app.config['INFERENCE_MAX_CONCURRENT'] < web_concurrency:
+    # A share of zero would admit nothing, and rounding it up to one would exceed the host-wide limit
+    raise ValueError(f"INFERENCE_MAX_CONCURRENT ({app.config['INFERENCE_MAX_CONCURRENT']}) must be at least "
+                     f"WEB_CONCURRENCY ({web_concurrency}), since each worker runs at least one inference")
+admission_controller = AdmissionController(
+    max_concurrent=app.config['INFERENCE_MAX_CONCURRENT'] // web_concurrency,
+    max_per_user=app.config['INFERENCE_MAX_PER_USER'],
+    memory_budget=app.config['INFERENCE_MEMORY_BUDGET_MB'] * 1024 ** 2 // web_concurrency,
+    bytes_per_pixel=app.config['INFERENCE_BYTES_PER_PIXEL'],
+    max_queue=app.config['INFERENCE_QUEUE_SIZE'],
+    queue_timeout=app.config['INFERENCE_QUEUE_TIMEOUT'],
+    reserved_priority=app.config['INFERENCE_ADMIN_RESERVED'],
+    retry_after=app.config['INFERENCE_RETRY_AFTER'],
+)
 
 user_registered.connect_via(app)
 
 
 @app.route('/')
 def index():
-    return render_template('index.html', user=current_user)
+    return render_template('index.html', user=current_user, models=available_models,
+                           default_model=app.config['MODEL_NAME'], overlay_opacity=app.config['OVERLAY_OPACITY'])
 
 
 @app.route('/custom_register', methods=['GET', 'POST'])
@@ -165,37 +246,41 @@ def get_image_data_id(image_id):
 
     image_segment = ImageSegment.query.filter_by(image_id=image_id).first()
     processed_filename = None
+    overlay_filename = None
+    model_name = None
     if image_segment:
         processed_filename = image_segment.processed_filename
+        overlay_filename = image_segment.overlay_filename
+        model_name = image_segment.model_name
 
     response = {
         'id': image.id,
         'original': image.filepath,
-        'segmented': processed_filename
+        'segmented': processed_filename,
+        'overlay': overlay_filename,
+        'model': model_name
     }
     return jsonify(response), 200
 
 
 @app.route('/get-image/<path:filename>', methods=['GET'])
 def get_image(filename):
-    logging.info(current_user.roles)
-
     try:
         # Download the file from S3
         logging.info("Downloading file from S3")
         file = download_file_from_s3(s3_client, filename, app.config['BUCKET_NAME'])
         logging.info("File downloaded successfully")
 
-        # Encode the file in Base64
-        base64_encoded_data = base64.b64encode(file.getvalue()).decode('utf-8')
-        image_data = f"data:image/jpeg;base64,{base64_encoded_data}"
-
         # Prepare metadata
         metadata = s3_client.head_object(Bucket=app.config['BUCKET_NAME'], Key=filename)
         logging.info("Metadata fetched successfully")
         content_type = metadata['ContentType']
         size = metadata['ContentLength']
 
+        # Encode the file in Base64
+        base64_encoded_data = base64.b64encode(file.getvalue()).decode('utf-8')
+        image_data = f"data:{content_type};base64,{base64_encoded_data}"
+
         response = {
             'filename': filename,
             'imageData': image_data,
@@ -207,6 +292,46 @@ def get_image(filename):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/get-composite/<int:image_id>', methods=['GET'])
+@roles_accepted('user', 'admin')
+def get_composite(image_id):
+    """Serve the original blended with its label overlay, rendering and caching it in S3 on first request."""
+    image_segment = ImageSegment.query.filter_by(image_id=image_id).first()
+    if not image_segment:
+        return jsonify({'error': 'Segment not found'}), 404
+
+    # Composites are rendered and cached per whole percent
+    try:
+        percent = opacity_percent(request.args.get('opacity', app.config['OVERLAY_OPACITY']))
+    except ValueError:
+        return jsonify({'error': 'opacity must be a number between 0 and 1'}), 400
+    opacity = percent / 100
+
+    if is_composite_at(image_segment.processed_filename, app.config['PROCESSED_FOLDER'], image_segment.id, percent):
+        return get_image(image_segment.processed_filename)
+    if not image_segment.overlay_filename:
+        return jsonify({'error': 'No overlay stored for this segment'}), 404
+
+    # Only the default composite is recorded on the segment; the reaper sweeps other opacities after a while
+    filepath = composite_filename(app.config['PROCESSED_FOLDER'], image_segment.id, percent)
+    bucket_name = app.config['BUCKET_NAME']
+    if not file_exists_in_s3(s3_client, filepath, bucket_name):
+        image = Image.query.get(image_id)
+        original_obj = download_file_from_s3(s3_client, image.filepath, bucket_name)
+        overlay_obj = download_file_from_s3(s3_client, image_segment.overlay_filename, bucket_name)
+        if original_obj is None or overlay_obj is None:
+            return jsonify({'error': 'File not found in S3'}), 404
+
+        composite = render_composite_off_loop(original_obj.getvalue(), overlay_obj.getvalue(), opacity)
+        upload_file_to_s3(s3_client, BytesIO(composite), filepath, bucket_name)
+        logging.info("Composite rendered and cached at %s", filepath)
+
+    if percent == opacity_percent(app.config['OVERLAY_OPACITY']):
+        image_segment.processed_filename = filepath
+        db.session.commit()
+    return get_image(filepath)
+
+
 @app.route('/get-image-list', methods=['GET'])
 def get_image_list():
     images = Image.query.filter_by(active=True).all()  # Fetching all active images
@@ -218,45 +343,83 @@ def get_image_list():
             image_list.append({
                 'id': image.id,
                 'original': image.filename,
-                'segmented': processed_filename
+                'segmented': processed_filename,
+                'overlay': image_segment.overlay_filename
             })
         else:
             image_list.append({
                 'id': image.id,
                 'original': image.filename,
-                'segmented': None
+                'segmented': None,
+                'overlay': None
             })
     return jsonify(image_list), 200
 
 
+@app.route('/export', methods=['GET'])
+@roles_accepted('user', 'admin')
+def export_images():
+    query = Image.query.filter_by(active=True)
+    ids = request.args.get('ids')
+    if ids:
+        try:
+            query = query.filter(Image.id.in_([int(image_id) for image_id in ids.split(',')]))
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma separated list of image ids'}), 400
+    images = query.order_by(Image.id).all()
+    image_ids = [image.id for image in images]
+    segments = {s.image_id: s for s in ImageSegment.query.filter(ImageSegment.image_id.in_(image_ids))}
+    entries, metadata = build_export(images, segments, opacity=app.config['OVERLAY_OPACITY'])
+
+    cache_dir = app.config['EXPORT_CACHE_DIR']
+    expire_cached_exports(cache_dir, app.config['EXPORT_CACHE_TTL'])
+    cache_key = export_cache_key(entries, metadata)
+    archive_path = os.path.join(cache_dir, f"{cache_key}.zip")
+    download_name = 'images-export.zip'
+    # Rebuilding an export gives the same bytes, so its cache key is a strong validator for If-Range
+    last_modified = max((image.timestamp for image in images if image.timestamp), default=None)
+    chunks = stream_zip(s3_client, app.config['BUCKET_NAME'], entries, metadata,
+                        prefetch=app.config['EXPORT_PREFETCH'], render=render_composite_off_loop)
+
+    # A range request resumes a download, so it needs the complete archive on disk
+    if request.range and not os.path.exists(archive_path):
+        for _ in cache_stream(chunks, archive_path):
+            pass
+
+    if os.path.exists(archive_path):
+        return send_file(archive_path, mimetype='application/zip', as_attachment=True, download_name=download_name,
+                         conditional=True, etag=cache_key, last_modified=last_modified)
+
+    # First download: stream it while it is cached. Without a length ranges are not offered yet, but the
+    # validators let a client resume against the cached copy
+    response = Response(stream_with_context(cache_stream(chunks, archive_path)), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename={download_name}'})
+    response.set_etag(cache_key)
+    response.last_modified = last_modified
+    return response
+
+
 @app.route('/delete-image/<int:image_id>', methods=['DELETE'])
 @roles_required('admin')  # Requires that the currently logged-in user has the 'admin' role
 def delete_image(image_id):
-    # Find the image and its segment
+    # Find the image
     image = Image.query.get(image_id)
     if not image:
         return jsonify({'error': 'Image not found'}), 404
 
-    image.active = False
-    image.deleted_at = datetime.utcnow()
-    db.session.commit()
+    # The files are removed from S3 in the background by the reaper (reaper.py)
+    if image.active:
+        image.active = False
+        image.deleted_at = datetime.utcnow()
+        db.session.commit()
 
-    image_segment = ImageSegment.query.filter_by(image_id=image_id).first()
+    return jsonify({'message': 'Image and its segment deleted successfully'}), 200
 
-    # Delete image files from S3
-    try:
-        error = delete_file_from_s3(s3_client, image.filepath, app.config['BUCKET_NAME'])
-        if error:
-            return jsonify({'error': error}), 500
-
-        if image_segment and image_segment.processed_filename:
-            error = delete_file_from_s3(s3_client, image_segment.processed_filename, app.config['BUCKET_NAME'])
-            if error:
-                return jsonify({'error': error}), 500
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
 
-    return jsonify({'message': 'Image and its segment deleted successfully'}), 200
+@app.route('/inference-stats', methods=['GET'])
+@roles_required('admin')
+def inference_stats():
+    return jsonify({**admission_controller.stats(), 'models': model_pool.stats()}), 200
 
 
 @app.route('/upload', methods=['POST'])
@@ -299,6 +462,11 @@ def upload_image():
 def apply_sam(image_id):
     logging.info("apply-sam")
     image = Image.query.get(image_id)
+    model_name = request.args.get('model', app.config['MODEL_NAME'])
+    if model_name not in model_artifacts.manifest:
+        return jsonify({'error': f'Unknown model {model_name}'}), 400
+    if model_name not in available_models:
+        return jsonify({'error': f'Model {model_name} is not available'}), 400
     if image.active:
 
         file_obj = download_file_from_s3(s3_client, image.filepath, app.config['BUCKET_NAME'])
@@ -307,65 +475,82 @@ def apply_sam(image_id):
         if file_obj is None:
             return jsonify({'error': 'File not found in S3'}), 404
 
-        # Open the image using OpenCV
-        file_bytes = np.asarray(bytearray(file_obj.read()), dtype=np.uint8)
-        original_image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-        if original_image is None:
-            return jsonify({'error': 'Error opening image file'}), 500
-
-        # delete previous segment images
-        ImageSegment.query.filter_by(image_id=image_id).delete()
-        db.session.commit()
-
-        # Convert image to RGB if necessary (OpenCV loads in BGR)
-        original_image_rgb = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
-        logging.info("Image opened successfully")
+        file_data = file_obj.read()
 
-        # Apply the SAM model to get the mask
-        # Assuming `mask_generator` is defined elsewhere and properly configured
-        masks_info = mask_generator.generate(original_image_rgb)
+        # Size the request from the image header so it is admitted before the pixels are decoded
+        original_image_rgb = None
+        dimensions = read_image_dimensions(file_data)
+        if dimensions is None:
+            original_image_rgb = inference_executor.run(decode_image_rgb, file_data)
+            if original_image_rgb is None:
+                return jsonify({'error': 'Error opening image file'}), 500
+            dimensions = original_image_rgb.shape[:2]
+        estimated_bytes = admission_controller.estimate_memory(*dimensions)
 
-        if not masks_info:
-            return jsonify({'error': 'No masks generated'}), 500
-
-        logging.info("Mask generated successfully")
-
-        # Generate the combined image with annotations
-        masked_image = create_segmentation_layer(masks_info, original_image_rgb)
-
-        logging.info("Masked image generated successfully")
-
-        rgba_image = create_rgba_image(original_image_rgb)
-
-        combined_image = combine_two_images(rgba_image, masked_image)
-
-        # Save the combined image to a BytesIO object
-        _, img_encoded = cv2.imencode('.jpg', cv2.cvtColor(combined_image, cv2.COLOR_RGB2BGR))
-        img_io = BytesIO(img_encoded)
+        try:
+            with admission_controller.admit(current_user.id, estimated_bytes, priority=current_user.has_role('admin')):
+                if original_image_rgb is None:
+                    original_image_rgb = inference_executor.run(decode_image_rgb, file_data)
+
+                if original_image_rgb is None:
+                    return jsonify({'error': 'Error opening image file'}), 500
+
+                # delete previous segment images
+                ImageSegment.query.filter_by(image_id=image_id).delete()
+                db.session.commit()
+                logging.info("Image opened successfully")
+
+                # Apply the SAM model to get the mask, off the event loop
+                with model_pool.acquire(model_name) as mask_generator:
+                    masks_info = inference_executor.run(mask_generator.generate, original_image_rgb)
+
+                if not masks_info:
+                    return jsonify({'error': 'No masks generated'}), 500
+
+                logging.info("Mask generated successfully")
+
+                num_segments = len(masks_info)
+                img_io, palette = inference_executor.run(render_segmentation, masks_info, original_image_rgb)
+                del original_image_rgb, masks_info
+        except AdmissionRejected as e:
+            headers = {'Retry-After': str(e.retry_after)} if e.retry_after else {}
+            return jsonify({'error': f'Inference request rejected: {e.reason}'}), e.status_code, headers
+        except ModelTooLarge as e:
+            return jsonify({'error': str(e)}), 400
+        except ModelPoolExhausted as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(app.config['INFERENCE_RETRY_AFTER'])}
 
         # Create a filename and upload to S3
         timestamp = datetime.utcnow().isoformat()
-        processed_filename = f"combined-{timestamp}.jpg"
+        if palette is not None:
+            extension = app.config['OVERLAY_FORMAT'].lower()
+            processed_filename = f"overlay-{timestamp}.{extension}"
+            content_type = f"image/{extension}"
+        else:
+            processed_filename = f"combined-{timestamp}.jpg"
+            content_type = "image/jpeg"
         filepath = os.path.join(app.config['PROCESSED_FOLDER'], processed_filename)
 
         img_io.seek(0)  # Seek to the start of the BytesIO object
 
-        file_url = upload_file_to_s3(s3_client, img_io, filepath, app.config['BUCKET_NAME'])
+        file_url = upload_file_to_s3(s3_client, img_io, filepath, app.config['BUCKET_NAME'], content_type)
         logging.info("Masked image uploaded to S3 successfully")
 
         # Store segment images
         new_segment = ImageSegment(
             image_id=image.id,
-            processed_filename=filepath,
-            num_segments=len(masks_info)
+            processed_filename=None if palette is not None else filepath,
+            overlay_filename=filepath if palette is not None else None,
+            palette=json.dumps(palette.tolist()) if palette is not None else None,
+            num_segments=num_segments,
+            model_name=model_name
         )
 
         logging.info("Segment images stored successfully")
         db.session.add(new_segment)
         db.session.commit()
 
-        return jsonify({'processedUrl': file_url}), 200
+        return jsonify({'processedUrl': file_url, 'model': model_name}), 200
     return jsonify({'error': 'No image URL provided'}), 400
 
 
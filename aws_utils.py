@@ -1,9 +1,21 @@
 from io import BytesIO
 import logging
+import os
+
+import boto3
 
 logging.basicConfig(level=logging.INFO)
 
-def upload_file_to_s3(s3_client, file, filename, bucket_name):
+
+def create_s3_client(region_name='us-east-1'):
+    """Create an S3 client from the AWS credentials in the environment."""
+    return boto3.client('s3',
+                        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                        region_name=region_name)
+
+
+def upload_file_to_s3(s3_client, file, filename, bucket_name, content_type="image/jpeg"):
     """Upload a file to an S3 bucket."""
     try:
         s3_client.upload_fileobj(
@@ -11,7 +23,7 @@ def upload_file_to_s3(s3_client, file, filename, bucket_name):
             bucket_name,
             filename,
             ExtraArgs={
-                "ContentType": "image/jpeg"
+                "ContentType": content_type
             }
         )
     except Exception as e:
@@ -31,6 +43,15 @@ def download_file_from_s3(s3_client, filename, bucket_name):
         return None
 
 
+def file_exists_in_s3(s3_client, filename, bucket_name):
+    """Return True if a file exists in an S3 bucket."""
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=filename)
+    except Exception:
+        return False
+    return True
+
+
 def delete_file_from_s3(s3_client, filename, bucket_name):
     """Delete a file from an S3 bucket."""
     try:
@@ -40,3 +61,27 @@ def delete_file_from_s3(s3_client, filename, bucket_name):
         return str(e)
     return None
 
+
+def delete_files_from_s3(s3_client, filenames, bucket_name):
+    """Delete files from an S3 bucket in batches, returning the keys that could not be deleted."""
+    failed = []
+    for start in range(0, len(filenames), 1000):  # delete_objects accepts at most 1000 keys
+        batch = filenames[start:start + 1000]
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        except Exception as e:
+            logging.error("Something happened: %s", e)
+            failed.extend(batch)
+    return failed
+
+
+def list_files_in_s3(s3_client, prefix, bucket_name):
+    """Yield (key, last_modified) for every object under a prefix of an S3 bucket."""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['LastModified']
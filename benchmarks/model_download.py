@@ -0,0 +1,85 @@
+"""Cold-start model download time against a local S3 stand-in.
+
+Uploads a random artifact to the bucket and times a single-stream
+``download_file`` (the previous startup path) against a cold-cache
+``ModelArtifactManager.ensure``, which does parallel ranged GETs and a
+SHA-256 check. Without ``--endpoint-url`` a moto S3 server is started
+locally; point it at MinIO or another stand-in to include real network costs:
+
+    python benchmarks/model_download.py --size-mb 375
+    python benchmarks/model_download.py --endpoint-url http://localhost:9000 --size-mb 375
+"""
+import argparse
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_artifacts import ModelArtifactManager  # noqa: E402
+
+BUCKET_NAME = 'benchmark-models'
+KEY = 'benchmark_model.pth'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--endpoint-url', help='S3-compatible endpoint; defaults to a local moto server')
+    parser.add_argument('--size-mb', type=int, default=375)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--chunk-mb', type=int, default=16)
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        from moto.server import ThreadedMotoServer
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+        server.start()
+        endpoint_url = f"http://127.0.0.1:{port}"
+
+    try:
+        s3_client = boto3.client('s3', endpoint_url=endpoint_url, region_name='us-east-1')
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        payload = os.urandom(args.size_mb * 1024 * 1024)
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=payload)
+        sha256 = hashlib.sha256(payload).hexdigest()
+        del payload
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            s3_client.download_file(BUCKET_NAME, KEY, os.path.join(cache_dir, 'single.pth'))
+            single = time.perf_counter() - start
+
+            manifest = {'benchmark': {'version': 'v1', 'model_type': 'vit_b', 'key': KEY, 'sha256': sha256}}
+            manager = ModelArtifactManager(s3_client, BUCKET_NAME, cache_dir, manifest, workers=args.workers,
+                                           chunk_size=args.chunk_mb * 1024 * 1024)
+            start = time.perf_counter()
+            manager.ensure('benchmark')
+            cold = time.perf_counter() - start
+
+            start = time.perf_counter()
+            manager.ensure('benchmark')
+            warm = time.perf_counter() - start
+
+        print(f"{args.size_mb} MB artifact via {endpoint_url}")
+        print(f"  download_file (single stream, unverified): {single:.2f}s")
+        print(f"  ensure, cold cache ({args.workers} workers, verified): {cold:.2f}s")
+        print(f"  ensure, warm cache: {warm * 1000:.1f}ms")
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
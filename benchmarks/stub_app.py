@@ -0,0 +1,61 @@
+"""Stand-in for app.py with the same route shapes, for load testing without the SAM model.
+
+``/get-image-list`` simulates a database query, ``/get-image/<key>`` reads the
+object from S3 (``S3_ENDPOINT_URL``, e.g. a moto server) and ``/apply-sam/<id>``
+runs ``STUB_INFERENCE_SECONDS`` of numpy work, which like torch releases the
+GIL, on the same :class:`InferenceExecutor` as the real app. Started by
+``benchmarks/load_test.py --stub``.
+"""
+import base64
+import os
+import sys
+import time
+
+import boto3
+import numpy as np
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference import InferenceExecutor  # noqa: E402
+
+BUCKET_NAME = os.environ.get('STUB_BUCKET_NAME', 'load-test')
+DB_LATENCY = float(os.environ.get('STUB_DB_LATENCY', 0.02))
+INFERENCE_SECONDS = float(os.environ.get('STUB_INFERENCE_SECONDS', 2.0))
+
+app = Flask(__name__)
+inference_executor = InferenceExecutor(max_workers=int(os.environ.get('INFERENCE_WORKERS', 1)))
+_s3_client = None
+
+
+def get_s3_client():
+    # Created after the fork, so each worker gets its own connection pool
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL'], region_name='us-east-1')
+    return _s3_client
+
+
+def _segment():
+    a = np.random.rand(512, 512)
+    deadline = time.perf_counter() + INFERENCE_SECONDS
+    while time.perf_counter() < deadline:
+        a = np.tanh(a @ a)
+    return float(a[0, 0])
+
+
+@app.route('/get-image-list')
+def get_image_list():
+    time.sleep(DB_LATENCY)
+    return jsonify([{'id': 1, 'original': 'dog.jpg', 'segmented': None}])
+
+
+@app.route('/get-image/<path:filename>')
+def get_image(filename):
+    body = get_s3_client().get_object(Bucket=BUCKET_NAME, Key=filename)['Body'].read()
+    return jsonify({'imageData': f"data:image/jpeg;base64,{base64.b64encode(body).decode('utf-8')}"})
+
+
+@app.route('/apply-sam/<int:image_id>')
+def apply_sam(image_id):
+    return jsonify({'id': image_id, 'result': inference_executor.run(_segment)})
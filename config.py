@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()  # This loads the env variables from .env file
 
@@ -16,11 +17,55 @@ class Config:
     if SQLALCHEMY_DATABASE_URI.startswith("postgres://"):
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace("postgres://", "postgresql://", 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    MODEL_TYPE = "vit_b"
-    CHECKPOINT_PATH = "ai_model/sam_vit_b_01ec64.pth"
+    MODEL_NAME = os.environ.get('MODEL_NAME', 'sam_vit_b')  # Default entry in the model manifest
+    MODEL_POOL_MEMORY_MB = int(os.environ.get('MODEL_POOL_MEMORY_MB', 4096))  # RAM for resident models, per worker
+    MODEL_POOL_WAIT_TIMEOUT = int(os.environ.get('MODEL_POOL_WAIT_TIMEOUT', 60))
+    MODEL_MANIFEST_PATH = os.environ.get('MODEL_MANIFEST_PATH', 'model_manifest.json')
+    MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', 'ai_model')  # May be a volume shared by containers
+    MODEL_DOWNLOAD_WORKERS = int(os.environ.get('MODEL_DOWNLOAD_WORKERS', 8))
+    MODEL_DOWNLOAD_CHUNK_MB = int(os.environ.get('MODEL_DOWNLOAD_CHUNK_MB', 16))
+    # Development only: use models without a pinned SHA-256, downloading them unverified on every start
+    MODEL_ALLOW_UNPINNED = os.environ.get('MODEL_ALLOW_UNPINNED', 'false').lower() == 'true'
     BUCKET_NAME = "ai-sam-models"
     S3_REGION = "us-east-1"
     S3_LOCATION = f'http://{BUCKET_NAME}.s3.amazonaws.com/'
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))  # Seconds a resolved user and roles are reused
+    # Seconds between checks for user and role changes made by other processes, the most they can be served stale
+    IDENTITY_CACHE_CHECK_INTERVAL = float(os.environ.get('IDENTITY_CACHE_CHECK_INTERVAL', 2))
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))  # gunicorn worker processes, see gunicorn.conf.py
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 1))  # Native threads running SAM per process
+    # Admission control for /apply-sam. INFERENCE_MAX_CONCURRENT and INFERENCE_MEMORY_BUDGET_MB are for the whole
+    # host: each of the WEB_CONCURRENCY workers enforces an equal share, so an image must fit in one share, and the
+    # app refuses to start with fewer concurrent inferences than workers.
+    # INFERENCE_MAX_PER_USER is enforced per worker, so with several workers a user may run up to that many each.
+    INFERENCE_MAX_CONCURRENT = int(os.environ.get('INFERENCE_MAX_CONCURRENT', INFERENCE_WORKERS * WEB_CONCURRENCY))
+    INFERENCE_MAX_PER_USER = int(os.environ.get('INFERENCE_MAX_PER_USER', 1))
+    INFERENCE_MEMORY_BUDGET_MB = int(os.environ.get('INFERENCE_MEMORY_BUDGET_MB', 4096))
+    # SAM encodes a 1024 px resize, a fixed cost covered by the model budget. What grows with the image is the
+    # mask decoding: each batch of prompt points upsamples 3 float32 logit masks per point to full resolution and
+    # thresholds them twice for the stability score (3 * (4 + 2) bytes per point), and the ~100 binary masks
+    # returned take a byte each. With 8 points per batch that is 8 * 18 + 100 = 244, so a 12 MP photo needs ~3 GB.
+    INFERENCE_POINTS_PER_BATCH = int(os.environ.get('INFERENCE_POINTS_PER_BATCH', 8))
+    INFERENCE_BYTES_PER_PIXEL = int(os.environ.get('INFERENCE_BYTES_PER_PIXEL',
+                                                   INFERENCE_POINTS_PER_BATCH * 18 + 100))
+    INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 4))
+    INFERENCE_QUEUE_TIMEOUT = int(os.environ.get('INFERENCE_QUEUE_TIMEOUT', 30))  # Seconds a request may wait
+    INFERENCE_ADMIN_RESERVED = int(os.environ.get('INFERENCE_ADMIN_RESERVED', 0))  # Slots only admins can use
+    INFERENCE_RETRY_AFTER = int(os.environ.get('INFERENCE_RETRY_AFTER', 30))
+    # Background reaper for deleted images (reaper.py)
+    REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', 300))  # Seconds between runs
+    REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 100))
+    REAPER_DELETE_ATTEMPTS = int(os.environ.get('REAPER_DELETE_ATTEMPTS', 3))
+    REAPER_ORPHAN_GRACE_MINUTES = int(os.environ.get('REAPER_ORPHAN_GRACE_MINUTES', 60))
+    REAPER_ARCHIVE_AFTER_DAYS = int(os.environ.get('REAPER_ARCHIVE_AFTER_DAYS', 30))
+    # 'overlay' stores an indexed label overlay composited on demand; 'composite' stores a blended JPEG
+    SEGMENTATION_OUTPUT = os.environ.get('SEGMENTATION_OUTPUT', 'overlay')
+    OVERLAY_FORMAT = os.environ.get('OVERLAY_FORMAT', 'png')  # png or webp
+    OVERLAY_OPACITY = float(os.environ.get('OVERLAY_OPACITY', 0.3))  # Default weight of the segment colors
+    # Bulk ZIP export (export.py)
+    EXPORT_PREFETCH = int(os.environ.get('EXPORT_PREFETCH', 4))  # S3 objects requested ahead of the one being written
+    EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sam-exports'))
+    EXPORT_CACHE_TTL = int(os.environ.get('EXPORT_CACHE_TTL', 24 * 3600))  # Seconds a cached archive can be resumed
     WTF_CSRF_ENABLED = False  # Disable CSRF protection
 
 
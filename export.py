@@ -0,0 +1,241 @@
+"""Streaming ZIP export of images, their segmentation layers and segment metadata.
+
+The archive is produced as a generator of byte chunks: objects are fetched
+from S3 with a bounded number of requests in flight and copied into ZIP
+entries as their bodies arrive, so memory use does not grow with the size of
+the export. Entries larger than 4 GiB and archives past the classic ZIP limits
+use ZIP64.
+
+Segments stored only as a label overlay get their composite rendered into the
+archive at the default opacity, next to the overlay and its palette.
+
+Export from the command line with ``python export.py images.zip``.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.response import StreamingBody
+
+from utils import render_composite
+
+logging.basicConfig(level=logging.INFO)
+
+# Entries with an overlay are composites rendered from the original at ``key`` and that overlay
+ExportEntry = namedtuple('ExportEntry', ['arcname', 'key', 'date_time', 'overlay', 'opacity'],
+                         defaults=[None, None])
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def _zip_date_time(timestamp):
+    # ZIP timestamps cannot predate 1980
+    if timestamp is None or timestamp.year < 1980:
+        return 1980, 1, 1, 0, 0, 0
+    return timestamp.timetuple()[:6]
+
+
+def build_export(images, segments, opacity=0.3):
+    """Return the S3 entries and the metadata document for exporting ``images``.
+
+    ``segments`` maps image id to its :class:`ImageSegment` (or is missing the id). Composites
+    that were never rendered are rendered at ``opacity`` while the archive is written.
+    """
+    entries = []
+    metadata = []
+    for image in images:
+        date_time = _zip_date_time(image.timestamp)
+        original = f"originals/{image.id}-{image.filename}"
+        entries.append(ExportEntry(original, image.filepath, date_time))
+        record = {
+            'id': image.id,
+            'filename': image.filename,
+            'timestamp': image.timestamp.isoformat() if image.timestamp else None,
+            'original': original,
+            'segmentation': None,
+        }
+        segment = segments.get(image.id)
+        if segment is not None:
+            record['segmentation'] = {
+                'composite': None,
+                'overlay': None,
+                'palette': json.loads(segment.palette) if segment.palette else None,
+                'num_segments': segment.num_segments,
+                'model': segment.model_name,
+            }
+            for kind, filename in (('composite', segment.processed_filename), ('overlay', segment.overlay_filename)):
+                if filename:
+                    arcname = f"segments/{image.id}-{os.path.basename(filename)}"
+                    entries.append(ExportEntry(arcname, filename, date_time))
+                    record['segmentation'][kind] = arcname
+            if segment.processed_filename is None and segment.overlay_filename:
+                arcname = f"segments/{image.id}-composite.jpg"
+                entries.append(ExportEntry(arcname, image.filepath, date_time, segment.overlay_filename, opacity))
+                record['segmentation']['composite'] = arcname
+        metadata.append(record)
+    return entries, metadata
+
+
+def export_cache_key(entries, metadata):
+    """Identify an export by its contents, so a changed image set gets a new cached archive."""
+    digest = hashlib.sha256()
+    for entry in entries:
+        digest.update(f"{entry.arcname}\0{entry.key}\0{entry.overlay}\0{entry.opacity}\n".encode())
+    digest.update(json.dumps(metadata, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def stream_zip(s3_client, bucket_name, entries, metadata, prefetch=4, render=render_composite):
+    """Yield a ZIP archive of the S3 ``entries`` followed by ``metadata.json``, chunk by chunk.
+
+    Up to ``prefetch`` objects are requested ahead of the one being written.
+    Composites are rendered by calling ``render(original, overlay, alpha)``, which
+    app.py points at the inference executor.
+    Objects missing from S3 are skipped and listed under ``missing`` in the metadata.
+    ``metadata.json`` is dated like the newest entry, so rebuilding the same export
+    for a resumed download gives the same bytes.
+    """
+    sink = _ChunkSink()
+    missing = []
+    metadata_date_time = max((entry.date_time for entry in entries), default=_zip_date_time(None))
+
+    def fetch(entry):
+        if entry.overlay is None:
+            return s3_client.get_object(Bucket=bucket_name, Key=entry.key)
+        original = s3_client.get_object(Bucket=bucket_name, Key=entry.key)['Body'].read()
+        overlay = s3_client.get_object(Bucket=bucket_name, Key=entry.overlay)['Body'].read()
+        composite = render(original, overlay, entry.opacity)
+        return {'ContentLength': len(composite), 'Body': StreamingBody(io.BytesIO(composite), len(composite))}
+
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = deque()
+        remaining = iter(entries)
+
+        def submit_next():
+            entry = next(remaining, None)
+            if entry is not None:
+                pending.append((entry, pool.submit(fetch, entry)))
+
+        for _ in range(prefetch):
+            submit_next()
+
+        try:
+            yield from _write_entries(sink, pending, submit_next, metadata, missing, metadata_date_time)
+        finally:
+            # Close the prefetched bodies if the client went away mid-archive
+            for _, future in pending:
+                if future.exception() is None:
+                    future.result()['Body'].close()
+
+
+def _write_entries(sink, pending, submit_next, metadata, missing, metadata_date_time):
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        while pending:
+            entry, future = pending.popleft()
+            submit_next()
+            try:
+                response = future.result()
+            except Exception as e:
+                logging.error("Skipping %s in export: %s", entry.key, e)
+                missing.append(entry.arcname)
+                continue
+
+            info = zipfile.ZipInfo(entry.arcname, entry.date_time)
+            info.compress_type = zipfile.ZIP_STORED  # Images are already compressed
+            info.file_size = response['ContentLength']
+            with archive.open(info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dest:
+                for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                    dest.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+
+        info = zipfile.ZipInfo('metadata.json', metadata_date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, json.dumps({'images': metadata, 'missing': missing}, indent=2))
+    yield from sink.drain()
+
+
+def cache_stream(chunks, path):
+    """Yield ``chunks`` while writing them to ``path``, which only appears once the stream is complete."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.export-')
+    complete = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+        complete = True
+    finally:
+        if not complete and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def expire_cached_exports(cache_dir, max_age):
+    """Remove cached archives older than ``max_age`` seconds."""
+    if not os.path.isdir(cache_dir):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.zip') and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export images, segmentations and metadata to a ZIP archive")
+    parser.add_argument('output')
+    parser.add_argument('--ids', type=int, nargs='*', help='Only export these image ids')
+    args = parser.parse_args()
+
+    from aws_utils import create_s3_client
+    from models import Image, ImageSegment, create_db_app
+
+    app = create_db_app()
+    s3_client = create_s3_client(app.config['S3_REGION'])
+    with app.app_context():
+        query = Image.query.filter_by(active=True)
+        if args.ids:
+            query = query.filter(Image.id.in_(args.ids))
+        images = query.order_by(Image.id).all()
+        image_ids = [image.id for image in images]
+        segments = {s.image_id: s for s in ImageSegment.query.filter(ImageSegment.image_id.in_(image_ids))}
+        entries, metadata = build_export(images, segments, opacity=app.config['OVERLAY_OPACITY'])
+
+    with open(args.output, 'wb') as f:
+        for chunk in stream_zip(s3_client, app.config['BUCKET_NAME'], entries, metadata,
+                                prefetch=app.config['EXPORT_PREFETCH']):
+            f.write(chunk)
+    logging.info("Exported %d images to %s", len(metadata), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+
+# S3 transfers and database queries are I/O-bound, so they are served from
+# gevent workers where a slow transfer only parks its own greenlet.
+# SAM inference runs on a bounded native threadpool (see inference.py).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))  # Each worker loads its own models
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative so database calls yield to other greenlets."""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
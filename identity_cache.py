@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+from flask_security import SQLAlchemyUserDatastore
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+logging.basicConfig(level=logging.INFO)
+
+
+class IdentityCache:
+    """Per-process TTL cache of resolved users and their roles, keyed by fs_uniquifier.
+
+    Entries are plain column snapshots rather than ORM instances, so they are
+    never tied to a session that has since been closed or expired.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return snapshot
+
+    def set(self, key, snapshot):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, snapshot)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _columns(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(type(obj)).column_attrs}
+
+
+def _detached(model, columns, **relationships):
+    """Build a clean detached instance, as if it had just been loaded and expunged."""
+    obj = inspect(model).class_manager.new_instance()
+    for key, value in {**columns, **relationships}.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return obj
+
+
+class CachingUserDatastore(SQLAlchemyUserDatastore):
+    """User datastore that serves session lookups from an :class:`IdentityCache`.
+
+    Flask-Security resolves the logged-in user on every request with
+    ``find_user(fs_uniquifier=...)`` and then reads ``user.roles``. A cache hit
+    rebuilds the user and roles from the snapshot and attaches them to the
+    session with ``merge(load=False)``, so neither step touches the database.
+    Entries are dropped whenever a flush changes or deletes a user or a role.
+
+    The same flush bumps the single row of ``version_model`` in its transaction.
+    Every process reads that counter at most once per ``check_interval`` seconds
+    and clears its cache when it moved, so a change committed by another worker
+    or by manage.py is seen within ``check_interval`` rather than ``ttl``.
+    Changes written with raw SQL must bump the counter themselves.
+    """
+
+    def __init__(self, db, user_model, role_model, version_model, ttl=60, check_interval=2):
+        super().__init__(db, user_model, role_model)
+        self.version_model = version_model
+        self.check_interval = check_interval
+        self.identity_cache = IdentityCache(ttl=ttl)
+        self._version = None
+        self._version_checked_at = float('-inf')
+        event.listen(db.session, 'after_flush', self._invalidate_on_flush)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.check_interval:
+            return
+        self._version_checked_at = now
+        version = self.db.session.execute(select(self.version_model.version)).scalar() or 0
+        if self._version is not None and version != self._version:
+            logging.info("Users or roles changed in another process, clearing identity cache")
+            self.identity_cache.clear()
+        self._version = version
+
+    def find_user(self, case_insensitive=False, **kwargs):
+        if case_insensitive or list(kwargs) != ['fs_uniquifier']:
+            return super().find_user(case_insensitive=case_insensitive, **kwargs)
+
+        self._check_version()
+        key = kwargs['fs_uniquifier']
+        snapshot = self.identity_cache.get(key)
+        if snapshot is not None:
+            return self._restore(snapshot)
+
+        user = super().find_user(**kwargs)
+        if user is not None:
+            self.identity_cache.set(key, {
+                'user': _columns(user),
+                'roles': [_columns(role) for role in user.roles],
+            })
+        return user
+
+    def _restore(self, snapshot):
+        roles = [_detached(self.role_model, columns) for columns in snapshot['roles']]
+        user = _detached(self.user_model, snapshot['user'], roles=roles)
+        return self.db.session.merge(user, load=False)
+
+    def _bump_version(self, session):
+        table = self.version_model.__table__
+        connection = session.connection()
+        if not connection.execute(table.update().values(version=table.c.version + 1)).rowcount:
+            connection.execute(table.insert().values(id=1, version=1))
+
+    def _invalidate_on_flush(self, session, flush_context):
+        changed = False
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, self.role_model):
+                logging.info("Role %s changed, clearing identity cache", obj.name)
+                self.identity_cache.clear()
+                changed = True
+                break
+            if isinstance(obj, self.user_model):
+                # A changed fs_uniquifier must also drop the entry under the old key
+                history = inspect(obj).attrs.fs_uniquifier.history
+                for key in [obj.fs_uniquifier, *history.deleted]:
+                    self.identity_cache.invalidate(key)
+                changed = True
+        if changed:
+            self._bump_version(session)
@@ -0,0 +1,175 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _gevent_is_active():
+    """Return True when the process runs under a monkey-patched gevent worker."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+class InferenceExecutor:
+    """Run CPU-bound inference on a bounded pool of native threads.
+
+    Under gevent workers the S3 and database routes yield cooperatively, but a
+    call into the SAM model would hold the hub for its whole duration. Running
+    it on gevent's native threadpool keeps the event loop free to serve the
+    I/O-bound requests, while ``max_workers`` caps how many inferences run at once.
+    Outside of gevent a regular thread pool is used, so behaviour is the same
+    with sync workers and the Flask dev server.
+    """
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._pool = None
+
+    def _get_pool(self):
+        # Created lazily so the pool belongs to the forked worker, not the master
+        if self._pool is None:
+            if _gevent_is_active():
+                from gevent.threadpool import ThreadPool
+                self._pool = ThreadPool(self.max_workers)
+                logging.info("Inference running on gevent threadpool (%d threads)", self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+                logging.info("Inference running on thread pool (%d threads)", self.max_workers)
+        return self._pool
+
+    def run(self, func, *args, **kwargs):
+        """Run ``func`` on the inference pool and wait for its result."""
+        pool = self._get_pool()
+        if isinstance(pool, ThreadPoolExecutor):
+            return pool.submit(func, *args, **kwargs).result()
+        return pool.apply(func, args, kwargs)
+
+
+class AdmissionRejected(Exception):
+    """Raised when an inference request is not admitted."""
+
+    def __init__(self, reason, status_code, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Admission control in front of inference.
+
+    A request is admitted only while the number of running inferences stays
+    under ``max_concurrent`` and the estimated working memory of everything
+    running stays under ``memory_budget`` bytes. Requests that do not fit wait
+    in a bounded queue for up to ``queue_timeout`` seconds. Each user may have
+    at most ``max_per_user`` requests running or queued. Priority (admin)
+    requests may use ``reserved_priority`` slots that others cannot, and are
+    served ahead of queued regular requests.
+
+    Limits apply per worker process, so app.py gives each worker its share of
+    the host-wide limits.
+    """
+
+    def __init__(self, max_concurrent=1, max_per_user=1, memory_budget=4 * 1024 ** 3, bytes_per_pixel=244,
+                 max_queue=4, queue_timeout=30, reserved_priority=0, retry_after=30):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.memory_budget = memory_budget
+        self.bytes_per_pixel = bytes_per_pixel
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.reserved_priority = reserved_priority
+        self.retry_after = retry_after
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._memory_in_use = 0
+        self._queued = 0
+        self._priority_queued = 0
+        self._active_by_user = Counter()
+        self._admitted = 0
+        self._rejections = Counter()
+
+    def estimate_memory(self, height, width):
+        """Estimate the working memory in bytes needed to segment an image of this size."""
+        return height * width * self.bytes_per_pixel
+
+    def _fits(self, estimated_bytes, priority):
+        slots = self.max_concurrent if priority else self.max_concurrent - self.reserved_priority
+        if self._in_flight >= slots:
+            return False
+        if not priority and self._priority_queued:
+            return False
+        return self._memory_in_use + estimated_bytes <= self.memory_budget
+
+    def _reject(self, reason, status_code, retry_after=None):
+        self._rejections[reason] += 1
+        logging.info("Inference request rejected: %s", reason)
+        raise AdmissionRejected(reason, status_code, retry_after)
+
+    def _release_user(self, user_id):
+        self._active_by_user[user_id] -= 1
+        if not self._active_by_user[user_id]:
+            del self._active_by_user[user_id]
+
+    @contextmanager
+    def admit(self, user_id, estimated_bytes, priority=False):
+        """Hold an inference slot for the duration of the block, or raise :class:`AdmissionRejected`."""
+        with self._condition:
+            if estimated_bytes > self.memory_budget:
+                self._reject('image_too_large', 413)
+            if self._active_by_user[user_id] >= self.max_per_user:
+                self._reject('per_user_limit', 429, self.retry_after)
+
+            if not self._fits(estimated_bytes, priority):
+                if self._queued >= self.max_queue:
+                    self._reject('queue_full', 503, self.retry_after)
+                self._active_by_user[user_id] += 1
+                self._queued += 1
+                self._priority_queued += priority
+                admitted = False
+                try:
+                    admitted = self._condition.wait_for(lambda: self._fits(estimated_bytes, priority),
+                                                        timeout=self.queue_timeout)
+                finally:
+                    self._queued -= 1
+                    self._priority_queued -= priority
+                    if not admitted:
+                        self._release_user(user_id)
+                    # A leaving priority request may unblock regular ones
+                    self._condition.notify_all()
+                if not admitted:
+                    self._reject('queue_timeout', 503, self.retry_after)
+            else:
+                self._active_by_user[user_id] += 1
+
+            self._in_flight += 1
+            self._memory_in_use += estimated_bytes
+            self._admitted += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._release_user(user_id)
+                self._in_flight -= 1
+                self._memory_in_use -= estimated_bytes
+                self._condition.notify_all()
+
+    def stats(self):
+        """Return a snapshot of the controller state for monitoring."""
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'queue_depth': self._queued,
+                'memory_in_use': self._memory_in_use,
+                'memory_budget': self.memory_budget,
+                'admitted': self._admitted,
+                'rejections': dict(self._rejections),
+            }
@@ -0,0 +1,44 @@
+"""Give archived rows their own ids and keep the originals in original_id
+
+Revision ID: e7a3c95d1b28
+Revises: 5d2b8e4a7f13
+Create Date: 2026-10-19 16:21:40.662917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a3c95d1b28'
+down_revision = '5d2b8e4a7f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('original_id', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('image_segment_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('original_id', sa.Integer(), nullable=True))
+
+    # Rows archived so far kept their original ids
+    op.execute('UPDATE image_archive SET original_id = id')
+    op.execute('UPDATE image_segment_archive SET original_id = id')
+
+    with op.batch_alter_table('image_archive', schema=None) as batch_op:
+        batch_op.alter_column('original_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_image_archive_original_id'), ['original_id'], unique=False)
+
+    with op.batch_alter_table('image_segment_archive', schema=None) as batch_op:
+        batch_op.alter_column('original_id', existing_type=sa.Integer(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image_segment_archive', schema=None) as batch_op:
+        batch_op.drop_column('original_id')
+
+    with op.batch_alter_table('image_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_archive_original_id'))
+        batch_op.drop_column('original_id')
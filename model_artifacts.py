@@ -0,0 +1,206 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class ModelArtifactError(Exception):
+    """Raised when a model artifact cannot be fetched or fails verification."""
+
+
+def load_manifest(path):
+    """Load the model manifest, a mapping of model name to version, S3 key, model type, checksum and size."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def pinned_digest(entry):
+    """Return the ``(algorithm, digest)`` a manifest entry is verified against, preferring SHA-256 over MD5."""
+    for algorithm in ('sha256', 'md5'):
+        if entry.get(algorithm):
+            return algorithm, entry[algorithm]
+    return None, None
+
+
+def file_digest(path, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on ``path`` so containers sharing the cache download only once."""
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ModelArtifactManager:
+    """Fetch model checkpoints listed in the manifest into a shared local cache.
+
+    Artifacts live under ``<cache_dir>/<name>/<version>/``. A download is split
+    into ranged GETs fetched in parallel into a temporary file, verified against
+    the manifest checksum and only then renamed into place, so a killed download
+    never leaves a file that looks complete. A ``.verified`` marker next to the
+    artifact records the check so later startups do not rehash it.
+
+    The checksum is the entry's ``sha256``, or the ``md5`` upstream publishes when
+    no SHA-256 is pinned. Models with neither are refused. With ``allow_unpinned`` they
+    are downloaded and used, but never marked verified, so every startup
+    fetches them again.
+    """
+
+    def __init__(self, s3_client, bucket_name, cache_dir, manifest, workers=8, chunk_size=16 * 1024 * 1024,
+                 allow_unpinned=False):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.cache_dir = cache_dir
+        self.manifest = manifest
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.allow_unpinned = allow_unpinned
+
+    def entry(self, name):
+        try:
+            return self.manifest[name]
+        except KeyError:
+            raise ModelArtifactError(f"Model {name} is not in the manifest")
+
+    def size(self, name):
+        """Return the checkpoint size in bytes from the manifest, or from S3 when it is not recorded there."""
+        entry = self.entry(name)
+        if entry.get('size') is not None:
+            return entry['size']
+        return self.s3_client.head_object(Bucket=self.bucket_name, Key=entry['key'])['ContentLength']
+
+    def local_path(self, name):
+        entry = self.entry(name)
+        return os.path.join(self.cache_dir, name, entry['version'], os.path.basename(entry['key']))
+
+    def ensure(self, name):
+        """Return the local path of a verified copy of the model, downloading it if needed."""
+        entry = self.entry(name)
+        if pinned_digest(entry)[1] is None and not self.allow_unpinned:
+            raise ModelArtifactError(f"No checksum pinned for model {name}, "
+                                     f"pin it with: python model_artifacts.py <checkpoint> --pin {name}")
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with _file_lock(f"{path}.lock"):
+            if self._is_verified(path, entry):
+                logging.info("Model %s %s already cached", name, entry['version'])
+                return path
+
+            if os.path.exists(path):
+                if pinned_digest(entry)[1] is not None:
+                    logging.warning("Cached model %s failed verification, downloading it again", name)
+                os.remove(path)
+
+            start = time.perf_counter()
+            size = self._download(entry['key'], path, *pinned_digest(entry))
+            logging.info("Model %s %s downloaded (%d bytes) in %.1fs", name, entry['version'], size,
+                         time.perf_counter() - start)
+        return path
+
+    def _is_verified(self, path, entry):
+        algorithm, expected = pinned_digest(entry)
+        if expected is None or not os.path.exists(path):
+            return False
+        marker = f"{path}.verified"
+        if os.path.exists(marker):
+            with open(marker) as f:
+                return f.read().strip() == expected
+        # Artifacts cached before verification existed are checked once
+        if file_digest(path, algorithm) == expected:
+            self._write_marker(path, expected)
+            return True
+        return False
+
+    def _write_marker(self, path, digest):
+        with open(f"{path}.verified", 'w') as f:
+            f.write(digest)
+
+    def _download(self, key, path, algorithm, expected):
+        size = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)['ContentLength']
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.download-')
+        try:
+            os.ftruncate(fd, size)
+            ranges = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # sum() re-raises the first failed range
+                written = sum(pool.map(lambda r: self._download_range(key, fd, *r), ranges))
+            os.fsync(fd)
+            os.close(fd)
+            fd = None
+
+            if written != size:
+                raise ModelArtifactError(f"Downloaded {written} bytes of {key}, expected {size}")
+            if expected is None:
+                logging.warning("No checksum pinned for %s, using it unverified (sha256=%s)", key,
+                                file_digest(tmp_path))
+            else:
+                digest = file_digest(tmp_path, algorithm)
+                if digest != expected:
+                    raise ModelArtifactError(f"Checksum mismatch for {key}: expected {algorithm} {expected}, "
+                                             f"got {digest}")
+
+            os.replace(tmp_path, path)
+            if expected is not None:
+                self._write_marker(path, expected)
+        except Exception:
+            if fd is not None:
+                os.close(fd)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return size
+
+    def _download_range(self, key, fd, start, end):
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end}")
+        offset = start
+        for block in response['Body'].iter_chunks(1024 * 1024):
+            os.pwrite(fd, block, offset)
+            offset += len(block)
+        if offset != end + 1:
+            raise ModelArtifactError(f"Short read for {key} range {start}-{end}")
+        return offset - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the SHA-256 and size of a model checkpoint for the manifest")
+    parser.add_argument('path')
+    parser.add_argument('--pin', metavar='NAME', help='Write the SHA-256 into this manifest entry')
+    parser.add_argument('--manifest', default='model_manifest.json')
+    args = parser.parse_args()
+    digest = file_digest(args.path)
+    print(json.dumps({'sha256': digest, 'size': os.path.getsize(args.path)}, indent=2))
+
+    if args.pin:
+        manifest = load_manifest(args.manifest)
+        if args.pin not in manifest:
+            parser.error(f"{args.pin} is not in {args.manifest}")
+        manifest[args.pin]['sha256'] = digest
+        manifest[args.pin]['size'] = os.path.getsize(args.path)
+        with open(args.manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ModelPoolExhausted(Exception):
+    """Raised when a model cannot be made resident within the memory budget."""
+
+
+class ModelTooLarge(ModelPoolExhausted):
+    """Raised when a model is larger than the whole memory budget, so waiting will never help."""
+
+
+class _Resident:
+    def __init__(self, model, size):
+        self.model = model
+        self.size = size
+        self.refcount = 0
+
+
+class ModelPool:
+    """Keep several models in memory under a byte budget, evicting the least recently used.
+
+    ``loader(name)`` returns ``(model, size_bytes)`` and ``estimate(name)`` the
+    expected size before loading. Models are loaded on first use; a model is
+    reference counted while a caller holds it through :meth:`acquire` and is
+    never evicted while in use. Callers that cannot get room wait up to
+    ``wait_timeout`` seconds for other models to be released.
+    """
+
+    def __init__(self, loader, estimate, memory_budget, wait_timeout=60):
+        self.loader = loader
+        self.estimate = estimate
+        self.memory_budget = memory_budget
+        self.wait_timeout = wait_timeout
+
+        self._condition = threading.Condition()
+        self._residents = OrderedDict()
+        self._loading = {}
+        self._loads = 0
+        self._evictions = 0
+
+    def _memory_in_use(self):
+        return sum(r.size for r in self._residents.values()) + sum(self._loading.values())
+
+    def _make_room(self, size):
+        """Evict idle models, least recently used first, until ``size`` more bytes fit."""
+        evicted = False
+        for name in list(self._residents):
+            if self._memory_in_use() + size <= self.memory_budget:
+                break
+            if self._residents[name].refcount == 0:
+                del self._residents[name]
+                self._evictions += 1
+                evicted = True
+                logging.info("Evicted model %s", name)
+        if evicted:
+            # Release the evicted weights before the replacement is loaded
+            gc.collect()
+        return self._memory_in_use() + size <= self.memory_budget
+
+    def _acquire(self, name):
+        estimated = None
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            while True:
+                resident = self._residents.get(name)
+                if resident is not None:
+                    self._residents.move_to_end(name)
+                    resident.refcount += 1
+                    return resident.model
+                if name not in self._loading:
+                    if estimated is None:
+                        # Estimating may ask S3 for the checkpoint size, so do it without the lock
+                        self._condition.release()
+                        try:
+                            estimated = self.estimate(name)
+                        finally:
+                            self._condition.acquire()
+                        continue
+                    if estimated > self.memory_budget:
+                        raise ModelTooLarge(f"Model {name} does not fit in the model memory budget")
+                    if self._make_room(estimated):
+                        self._loading[name] = estimated
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise ModelPoolExhausted(f"Timed out waiting for room to load model {name}")
+
+        try:
+            start = time.perf_counter()
+            model, size = self.loader(name)
+            logging.info("Loaded model %s (%d bytes) in %.2fs", name, size, time.perf_counter() - start)
+        except Exception:
+            with self._condition:
+                del self._loading[name]
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            del self._loading[name]
+            resident = _Resident(model, size)
+            resident.refcount = 1
+            self._residents[name] = resident
+            self._loads += 1
+            self._condition.notify_all()
+        return model
+
+    def _release(self, name):
+        with self._condition:
+            self._residents[name].refcount -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def acquire(self, name):
+        """Yield the named model, loading it if needed, and keep it resident for the duration of the block."""
+        model = self._acquire(name)
+        try:
+            yield model
+        finally:
+            self._release(name)
+
+    def stats(self):
+        """Return the resident models and pool counters for monitoring."""
+        with self._condition:
+            return {
+                'resident': {name: {'size': r.size, 'in_use': r.refcount} for name, r in self._residents.items()},
+                'loading': list(self._loading),
+                'memory_in_use': self._memory_in_use(),
+                'memory_budget': self.memory_budget,
+                'loads': self._loads,
+                'evictions': self._evictions,
+            }
@@ -1,9 +1,24 @@
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_security import UserMixin, RoleMixin
 
+from config import Config
+
 db = SQLAlchemy()
 
+
+def create_db_app(config_object=Config, **overrides):
+    """Create a minimal app with only the database, for scripts that run outside the web process.
+
+    ``overrides`` are applied before the database is initialised, which reads the engine settings.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    app.config.update(overrides)
+    db.init_app(app)
+    return app
+
 # Association table for many-to-many relationship between AppUsers and Roles
 user_roles = db.Table('user_roles',
                       db.Column('appuser_id', db.Integer, db.ForeignKey('app_user.id'), primary_key=True),
@@ -35,6 +50,12 @@ class AppUser(db.Model, UserMixin):
         return f'<AppUser {self.username}>'
 
 
+class IdentityVersion(db.Model):
+    """Single row counting user and role changes, so every process can drop identities it has cached."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(120), nullable=False)
@@ -42,6 +63,7 @@ class Image(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     active = db.Column(db.Boolean, default=True, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)
+    purged_at = db.Column(db.DateTime, nullable=True)  # When the reaper removed the files from S3
 
 
 class ImageSegment(db.Model):
@@ -49,11 +71,38 @@ class ImageSegment(db.Model):
     image_id = db.Column(db.Integer, db.ForeignKey('image.id', name='fk_image_segment_image_id'), nullable=False)
     processed_filename = db.Column(db.String(256), nullable=True)
     num_segments = db.Column(db.Integer, nullable=False)  # Storing the count of segments
+    model_name = db.Column(db.String(50), nullable=True)  # Manifest entry of the model that produced the segments
+    overlay_filename = db.Column(db.String(256), nullable=True)  # Indexed label overlay, label 0 transparent
+    palette = db.Column(db.Text, nullable=True)  # JSON list of the overlay's RGB colors, indexed by label
 
     def __repr__(self):
         return f'<ImageSegment {self.processed_filename}>'
 
 
+class ImageArchive(db.Model):
+    """Deleted images moved out of the image table once their files are purged."""
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False, index=True)  # SQLite reuses image ids, so not unique
+    filename = db.Column(db.String(120), nullable=False)
+    filepath = db.Column(db.String(120), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    purged_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ImageSegmentArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, nullable=False)
+    image_id = db.Column(db.Integer, db.ForeignKey('image_archive.id', name='fk_image_segment_archive_image_id'),
+                         nullable=False)
+    processed_filename = db.Column(db.String(256), nullable=True)
+    num_segments = db.Column(db.Integer, nullable=False)
+    model_name = db.Column(db.String(50), nullable=True)
+    overlay_filename = db.Column(db.String(256), nullable=True)
+    palette = db.Column(db.Text, nullable=True)
+
+
 def init_roles():
     roles = ['admin', 'user']
     for role_name in roles:
@@ -0,0 +1,179 @@
+"""Background garbage collection for soft-deleted images.
+
+Runs three jobs against the database and the S3 bucket:
+
+* purge: batch-delete the files of soft-deleted images, with retries, and mark them purged
+* sweep: delete files under the upload and segment folders that no image references
+* archive: move purged images older than the retention period into the archive tables
+
+Run it as its own process so it never loads the SAM model, e.g. ``python reaper.py --loop``.
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from aws_utils import create_s3_client, delete_files_from_s3, list_files_in_s3
+from models import db, Image, ImageSegment, ImageArchive, ImageSegmentArchive, create_db_app
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _delete_with_retries(s3_client, keys, bucket_name, attempts, backoff):
+    """Delete keys from S3, retrying failures with exponential backoff. Returns the keys that still failed."""
+    pending = sorted(keys)
+    for attempt in range(attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        pending = delete_files_from_s3(s3_client, pending, bucket_name)
+    return set(pending)
+
+
+def purge_deleted_images(s3_client, bucket_name, batch_size=100, attempts=3, backoff=1.0):
+    """Delete the S3 files of soft-deleted images and mark them purged. Returns the number purged."""
+    images = (Image.query
+              .filter(Image.active.is_(False), Image.purged_at.is_(None))
+              .order_by(Image.deleted_at)
+              .limit(batch_size)
+              .all())
+    if not images:
+        return 0
+
+    keys_by_image = {image.id: {image.filepath} for image in images}
+    segments = ImageSegment.query.filter(ImageSegment.image_id.in_(list(keys_by_image))).all()
+    for segment in segments:
+        for filename in (segment.processed_filename, segment.overlay_filename):
+            if filename:
+                keys_by_image[segment.image_id].add(filename)
+
+    all_keys = set().union(*keys_by_image.values())
+    failed = _delete_with_retries(s3_client, all_keys, bucket_name, attempts, backoff)
+    if failed:
+        logging.error("Could not delete %d files, will retry on the next run", len(failed))
+
+    now = datetime.utcnow()
+    purged = 0
+    for image in images:
+        if not keys_by_image[image.id] & failed:
+            image.purged_at = now
+            purged += 1
+    db.session.commit()
+    logging.info("Purged files of %d deleted images", purged)
+    return purged
+
+
+def sweep_orphaned_files(s3_client, bucket_name, prefixes, grace_period=timedelta(hours=1), attempts=3,
+                         backoff=1.0):
+    """Delete files under ``prefixes`` that no unpurged image or segment references. Returns the number deleted.
+
+    Files newer than ``grace_period`` are kept, since uploads reach S3 before their row is committed.
+    This also expires composites rendered on demand at a non-default opacity, which no row references.
+    """
+    referenced = {filepath for filepath, in db.session.query(Image.filepath).filter(Image.purged_at.is_(None))}
+    for processed_filename, overlay_filename in (db.session.query(ImageSegment.processed_filename,
+                                                                  ImageSegment.overlay_filename)
+                                                 .join(Image, Image.id == ImageSegment.image_id)
+                                                 .filter(Image.purged_at.is_(None))):
+        referenced.update(filename for filename in (processed_filename, overlay_filename) if filename)
+
+    cutoff = datetime.now(timezone.utc) - grace_period
+    orphans = [
+        key
+        for prefix in prefixes
+        for key, last_modified in list_files_in_s3(s3_client, prefix, bucket_name)
+        if key not in referenced and last_modified < cutoff
+    ]
+    if not orphans:
+        return 0
+
+    failed = _delete_with_retries(s3_client, orphans, bucket_name, attempts, backoff)
+    logging.info("Swept %d orphaned files", len(orphans) - len(failed))
+    return len(orphans) - len(failed)
+
+
+def archive_deleted_images(older_than=timedelta(days=30), batch_size=100):
+    """Move purged images deleted more than ``older_than`` ago into the archive tables. Returns the number moved."""
+    cutoff = datetime.utcnow() - older_than
+    images = (Image.query
+              .filter(Image.purged_at.isnot(None), Image.deleted_at < cutoff)
+              .order_by(Image.deleted_at)
+              .limit(batch_size)
+              .all())
+    if not images:
+        return 0
+
+    image_ids = [image.id for image in images]
+    segments = ImageSegment.query.filter(ImageSegment.image_id.in_(image_ids)).all()
+
+    # Archived rows get their own ids, since SQLite hands the ids of deleted images out again
+    archives = {}
+    for image in images:
+        archives[image.id] = ImageArchive(
+            original_id=image.id,
+            filename=image.filename,
+            filepath=image.filepath,
+            timestamp=image.timestamp,
+            deleted_at=image.deleted_at,
+            purged_at=image.purged_at
+        )
+        db.session.add(archives[image.id])
+    db.session.flush()
+    for segment in segments:
+        db.session.add(ImageSegmentArchive(
+            original_id=segment.id,
+            image_id=archives[segment.image_id].id,
+            processed_filename=segment.processed_filename,
+            num_segments=segment.num_segments,
+            model_name=segment.model_name,
+            overlay_filename=segment.overlay_filename,
+            palette=segment.palette
+        ))
+        db.session.delete(segment)
+    db.session.flush()
+    for image in images:
+        db.session.delete(image)
+    db.session.commit()
+    logging.info("Archived %d deleted images", len(images))
+    return len(images)
+
+
+def run_once(app, s3_client):
+    """Run every reaper job once."""
+    config = app.config
+    batch_size = config['REAPER_BATCH_SIZE']
+    with app.app_context():
+        # Full batches mean there may be more waiting
+        while purge_deleted_images(s3_client, config['BUCKET_NAME'], batch_size=batch_size,
+                                   attempts=config['REAPER_DELETE_ATTEMPTS']) == batch_size:
+            pass
+        sweep_orphaned_files(s3_client, config['BUCKET_NAME'], [config['UPLOAD_FOLDER'], config['PROCESSED_FOLDER']],
+                             grace_period=timedelta(minutes=config['REAPER_ORPHAN_GRACE_MINUTES']),
+                             attempts=config['REAPER_DELETE_ATTEMPTS'])
+        while archive_deleted_images(older_than=timedelta(days=config['REAPER_ARCHIVE_AFTER_DAYS']),
+                                     batch_size=batch_size) == batch_size:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge, sweep and archive deleted images")
+    parser.add_argument('--loop', action='store_true', help='Keep running every REAPER_INTERVAL seconds')
+    args = parser.parse_args()
+
+    app = create_db_app()
+    s3_client = create_s3_client(app.config['S3_REGION'])
+    while True:
+        try:
+            run_once(app, s3_client)
+        except Exception as e:
+            if not args.loop:
+                raise
+            logging.error("Reaper run failed: %s", e)
+        if not args.loop:
+            break
+        time.sleep(app.config['REAPER_INTERVAL'])
+
+
+if __name__ == '__main__':
+    main()
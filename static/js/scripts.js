@@ -152,15 +152,19 @@ function showSelectedImage() {
     fetch(`/get-image-data-from-id/${imageId}`)
         .then(response => response.json())
         .then(data => {
-            if (!data.original && !data.segmented) {
+            if (!data.original && !data.segmented && !data.overlay) {
                 throw new Error('No images available');
             }
             // If there's an original image, fetch and display it
             if (data.original) {
                 fetchAndDisplayImage(data.original, 'original-gallery');
             }
+            // Prefer the label overlay, composited over the original in the browser
+            if (data.overlay && data.original) {
+                displayOverlay(data.original, data.overlay, 'segmented-gallery');
+            }
             // If there's a segmented image, fetch and display it
-            if (data.segmented) {
+            else if (data.segmented) {
                 fetchAndDisplayImage(data.segmented, 'segmented-gallery');
             }
             else {
@@ -179,6 +183,39 @@ function fetchAndDisplayImage(filename, galleryId) {
         .catch(error => console.error('Error fetching image data:', error));
 }
 
+function fetchImageData(filename) {
+    return fetch(`/get-image/${filename}`)
+        .then(response => response.json())
+        .then(data => data.imageData);
+}
+
+function displayOverlay(original, overlay, galleryId) {
+    Promise.all([fetchImageData(original), fetchImageData(overlay)])
+        .then(([originalData, overlayData]) => {
+            let gallery = document.getElementById(galleryId);
+            let imgContainer = document.createElement('div');
+            imgContainer.className = 'image-container overlay-container';
+            let base = document.createElement('img');
+            base.src = originalData;
+            let layer = document.createElement('img');
+            layer.src = overlayData;
+            layer.className = 'overlay-layer';
+            imgContainer.appendChild(base);
+            imgContainer.appendChild(layer);
+            gallery.appendChild(imgContainer);
+            updateOverlayOpacity();
+        })
+        .catch(error => console.error('Error fetching overlay data:', error));
+}
+
+function updateOverlayOpacity() {
+    let slider = document.getElementById('overlayOpacity');
+    let layer = document.querySelector('.overlay-layer');
+    if (slider && layer) {
+        layer.style.opacity = slider.value / 100;
+    }
+}
+
 function deleteSelectedImage() {
     let imageId = document.getElementById('imageDropdown').value;
     if (!imageId) {
@@ -247,14 +284,22 @@ function applySam() {
         alert('Please select an image to apply SAM.');
         return;
     }
+    let model = document.getElementById('modelDropdown').value;
     addLoader();
-    fetch(`/apply-sam/${imageId}`)
+    fetch(`/apply-sam/${imageId}?model=${encodeURIComponent(model)}`)
         .then(response => {
             if (!response.ok) {
                 if (response.status === 403) {
                     removeLoader();
                    alert("you do not have the proper permissions"); // Only show alert if there's an error
                 }
+                else if ([413, 429, 503].includes(response.status)) {
+                    removeLoader();
+                    const retryAfter = response.headers.get('Retry-After');
+                    alert(retryAfter
+                        ? `The server is busy, please try again in ${retryAfter} seconds`
+                        : 'This image is too large to segment');
+                }
                 throw new Error('Network response was not ok.');
             }
             else {
@@ -0,0 +1,17 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+
+@pytest.fixture
+def bucket_name():
+    """Bucket created by ``s3_client``; override it in a module to use another name."""
+    return 'test-bucket'
+
+
+@pytest.fixture
+def s3_client(bucket_name):
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=bucket_name)
+        yield client
@@ -0,0 +1,104 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from inference import AdmissionController, AdmissionRejected
+from utils import read_image_dimensions
+
+THIS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+TEST_IMAGE_PATH = os.path.join(THIS_FOLDER, 'test_image.jpg')
+
+
+@pytest.mark.parametrize('ext', ['.jpg', '.png', '.webp'])
+def test_read_image_dimensions_matches_decoded_shape(ext):
+    image = np.zeros((37, 53, 3), dtype=np.uint8)
+    _, encoded = cv2.imencode(ext, image)
+    assert read_image_dimensions(encoded.tobytes()) == (37, 53)
+
+
+def test_read_image_dimensions_of_test_image():
+    with open(TEST_IMAGE_PATH, 'rb') as f:
+        data = f.read()
+    decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert read_image_dimensions(data) == decoded.shape[:2]
+    assert read_image_dimensions(b'not an image') is None
+
+
+def test_rejects_image_over_memory_budget():
+    controller = AdmissionController(memory_budget=100, bytes_per_pixel=1)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit('user', controller.estimate_memory(20, 20)):
+            pass
+    assert excinfo.value.status_code == 413
+    assert controller.stats()['rejections'] == {'image_too_large': 1}
+
+
+def test_per_user_limit_returns_429():
+    controller = AdmissionController(max_concurrent=2, max_per_user=1, retry_after=5)
+    with controller.admit('user', 0):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit('user', 0):
+                pass
+        with controller.admit('other', 0):
+            assert controller.stats()['in_flight'] == 2
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.retry_after == 5
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_full_queue_returns_503():
+    controller = AdmissionController(max_concurrent=1, max_queue=0)
+    with controller.admit('a', 0):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit('b', 0):
+                pass
+    assert excinfo.value.status_code == 503
+    assert controller.stats()['rejections'] == {'queue_full': 1}
+
+
+def test_queued_request_times_out():
+    controller = AdmissionController(max_concurrent=1, queue_timeout=0.05)
+    with controller.admit('a', 0):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit('b', 0):
+                pass
+    assert excinfo.value.reason == 'queue_timeout'
+    assert controller.stats()['queue_depth'] == 0
+
+
+def test_memory_budget_queues_until_release():
+    controller = AdmissionController(max_concurrent=2, memory_budget=10, bytes_per_pixel=1, queue_timeout=5)
+    admitted = threading.Event()
+
+    def second_request():
+        with controller.admit('b', 6):
+            admitted.set()
+
+    with controller.admit('a', 6):
+        thread = threading.Thread(target=second_request)
+        thread.start()
+        assert not admitted.wait(0.1)
+        assert controller.stats()['queue_depth'] == 1
+    thread.join(5)
+    assert admitted.is_set()
+
+
+def test_reserved_slot_only_for_priority():
+    controller = AdmissionController(max_concurrent=2, max_queue=0, reserved_priority=1)
+    with controller.admit('a', 0):
+        with pytest.raises(AdmissionRejected):
+            with controller.admit('b', 0):
+                pass
+        with controller.admit('admin', 0, priority=True):
+            assert controller.stats()['in_flight'] == 2
+
+
+def test_default_budget_admits_twelve_megapixel_photo():
+    from config import Config
+    controller = AdmissionController(memory_budget=Config.INFERENCE_MEMORY_BUDGET_MB * 1024 ** 2,
+                                     bytes_per_pixel=Config.INFERENCE_BYTES_PER_PIXEL)
+    with controller.admit(1, controller.estimate_memory(3024, 4032)):
+        pass
@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from export import build_export, cache_stream, export_cache_key, stream_zip
+from utils import create_label_overlay, encode_label_overlay
+
+BUCKET_NAME = 'test-images'
+
+
+@pytest.fixture
+def bucket_name():
+    return BUCKET_NAME
+
+
+def make_images(s3_client, count):
+    images, segments = [], {}
+    for image_id in range(1, count + 1):
+        filepath = f"images/uploads/{image_id}.jpg"
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=filepath, Body=os.urandom(1000 + image_id))
+        images.append(SimpleNamespace(id=image_id, filename=f"{image_id}.jpg", filepath=filepath,
+                                      timestamp=datetime(2024, 7, 23, 3, 57, 11)))
+        if image_id % 2:
+            processed = f"images/segments/combined-{image_id}.jpg"
+            s3_client.put_object(Bucket=BUCKET_NAME, Key=processed, Body=os.urandom(500))
+            segments[image_id] = SimpleNamespace(processed_filename=processed, num_segments=image_id,
+                                                 overlay_filename=None, palette=None,
+                                                 model_name='sam_vit_b')
+    return images, segments
+
+
+def test_stream_zip_contains_originals_composites_and_metadata(s3_client):
+    images, segments = make_images(s3_client, 5)
+    entries, metadata = build_export(images, segments)
+
+    data = b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata, prefetch=2))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert names[-1] == 'metadata.json'
+        assert len(names) == len(entries) + 1
+        for entry in entries:
+            body = s3_client.get_object(Bucket=BUCKET_NAME, Key=entry.key)['Body'].read()
+            assert archive.read(entry.arcname) == body
+        exported = json.loads(archive.read('metadata.json'))
+    assert [record['id'] for record in exported['images']] == [1, 2, 3, 4, 5]
+    assert exported['images'][0]['segmentation']['num_segments'] == 1
+    assert exported['images'][1]['segmentation'] is None
+    assert exported['missing'] == []
+
+
+def test_missing_objects_are_skipped_and_listed(s3_client):
+    images, segments = make_images(s3_client, 2)
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key='images/uploads/2.jpg')
+    entries, metadata = build_export(images, segments)
+
+    data = b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert 'originals/2-2.jpg' not in archive.namelist()
+        assert json.loads(archive.read('metadata.json'))['missing'] == ['originals/2-2.jpg']
+
+
+def make_overlay_only_image(s3_client, original):
+    mask = np.zeros((40, 60), dtype=bool)
+    mask[10:30, 10:30] = True
+    labels, palette = create_label_overlay([{'segmentation': mask, 'area': int(mask.sum())}], original.shape)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='images/uploads/1.jpg',
+                         Body=cv2.imencode('.jpg', original)[1].tobytes())
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='images/segments/overlay-1.png',
+                         Body=encode_label_overlay(labels, palette).getvalue())
+    images = [SimpleNamespace(id=1, filename='1.jpg', filepath='images/uploads/1.jpg', timestamp=None)]
+    segments = {1: SimpleNamespace(processed_filename=None, overlay_filename='images/segments/overlay-1.png',
+                                   palette=json.dumps(palette.tolist()), num_segments=1, model_name='sam_vit_b')}
+    return images, segments, palette
+
+
+def test_overlay_only_segment_gets_rendered_composite(s3_client):
+    original = np.random.randint(0, 256, (40, 60, 3), dtype=np.uint8)
+    images, segments, palette = make_overlay_only_image(s3_client, original)
+    entries, metadata = build_export(images, segments, opacity=0.5)
+
+    data = b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        segmentation = json.loads(archive.read('metadata.json'))['images'][0]['segmentation']
+        assert segmentation['overlay'] == 'segments/1-overlay-1.png'
+        assert segmentation['palette'] == palette.tolist()
+        composite = cv2.imdecode(np.frombuffer(archive.read(segmentation['composite']), np.uint8), cv2.IMREAD_COLOR)
+    assert composite.shape == original.shape
+
+
+def test_composites_are_rendered_by_the_given_renderer(s3_client):
+    original = np.random.randint(0, 256, (40, 60, 3), dtype=np.uint8)
+    images, segments, _ = make_overlay_only_image(s3_client, original)
+    entries, metadata = build_export(images, segments, opacity=0.5)
+    calls = []
+
+    def render(original, overlay, alpha):
+        calls.append(alpha)
+        return b'composite'
+
+    data = b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata, render=render))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.read('segments/1-composite.jpg') == b'composite'
+    assert calls == [0.5]
+
+
+def test_cache_key_changes_with_contents(s3_client):
+    images, segments = make_images(s3_client, 3)
+    key = export_cache_key(*build_export(images, segments))
+    assert key == export_cache_key(*build_export(images, segments))
+    assert key != export_cache_key(*build_export(images[:2], segments))
+
+
+def test_rebuilt_archive_is_byte_identical(s3_client, monkeypatch):
+    images, segments = make_images(s3_client, 3)
+    entries, metadata = build_export(images, segments)
+
+    first = b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata))
+    monkeypatch.setattr('time.localtime', lambda *args: (2030, 1, 1, 0, 0, 0, 0, 1, 0))
+    assert b''.join(stream_zip(s3_client, BUCKET_NAME, entries, metadata)) == first
+    with zipfile.ZipFile(io.BytesIO(first)) as archive:
+        assert archive.getinfo('metadata.json').date_time == (2024, 7, 23, 3, 57, 10)
+
+
+def test_cache_stream_only_publishes_complete_archives(tmp_path):
+    path = str(tmp_path / 'export.zip')
+    stream = cache_stream(iter([b'a', b'b', b'c']), path)
+    assert next(stream) == b'a'
+    stream.close()
+    assert os.listdir(str(tmp_path)) == []
+
+    assert b''.join(cache_stream(iter([b'a', b'b', b'c']), path)) == b'abc'
+    with open(path, 'rb') as f:
+        assert f.read() == b'abc'
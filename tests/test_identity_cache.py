@@ -0,0 +1,127 @@
+import pytest
+from flask import Flask, jsonify
+from flask_security import Security, roles_accepted
+from sqlalchemy import event, text
+
+from identity_cache import CachingUserDatastore
+from models import db, AppUser, Role, IdentityVersion, init_roles
+
+
+@pytest.fixture(scope='module')
+def cache_app():
+    app = Flask(__name__)
+    app.config.from_object('config.TestConfig')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SECRET_KEY'] = 'test-secret'
+    db.init_app(app)
+    datastore = CachingUserDatastore(db, AppUser, Role, IdentityVersion, ttl=60, check_interval=60)
+    Security(app, datastore)
+
+    @app.route('/protected')
+    @roles_accepted('user', 'admin')
+    def protected():
+        return jsonify({'ok': True}), 200
+
+    with app.app_context():
+        db.create_all()
+        init_roles()
+        datastore.create_user(username='cacheuser', password='x', roles=['user'])
+        db.session.commit()
+
+    app.datastore = datastore
+    yield app
+
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def logged_in_client(cache_app):
+    cache_app.datastore.identity_cache.clear()
+    client = cache_app.test_client()
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        fs_uniquifier = user.fs_uniquifier
+    with client.session_transaction() as session:
+        session['_user_id'] = fs_uniquifier
+        session['_fresh'] = True
+    return client
+
+
+def count_queries(app, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return result, statements
+
+
+def test_cached_identity_skips_user_and_role_queries(cache_app, logged_in_client):
+    response, first = count_queries(cache_app, lambda: logged_in_client.get('/protected'))
+    assert response.status_code == 200
+    assert len(first) > 0
+
+    response, second = count_queries(cache_app, lambda: logged_in_client.get('/protected'))
+    assert response.status_code == 200
+    assert second == []
+
+
+def test_role_change_invalidates_cached_identity(cache_app, logged_in_client):
+    assert logged_in_client.get('/protected').status_code == 200
+
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        cache_app.datastore.remove_role_from_user(user, 'user')
+        db.session.commit()
+
+    assert logged_in_client.get('/protected').status_code == 403
+
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        cache_app.datastore.add_role_to_user(user, 'user')
+        db.session.commit()
+
+    assert logged_in_client.get('/protected').status_code == 200
+
+
+def test_deactivation_invalidates_cached_identity(cache_app, logged_in_client):
+    assert logged_in_client.get('/protected').status_code == 200
+
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        cache_app.datastore.deactivate_user(user)
+        db.session.commit()
+
+    assert logged_in_client.get('/protected').status_code != 200
+
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        cache_app.datastore.activate_user(user)
+        db.session.commit()
+
+
+def test_change_from_another_process_invalidates_cached_identity(cache_app, logged_in_client, monkeypatch):
+    monkeypatch.setattr(cache_app.datastore, 'check_interval', 0)
+    assert logged_in_client.get('/protected').status_code == 200
+
+    # Another worker deactivates the user; this process's flush listener never sees it
+    with cache_app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text("UPDATE app_user SET active = false WHERE username = 'cacheuser'"))
+            connection.execute(text("UPDATE identity_version SET version = version + 1"))
+
+    assert logged_in_client.get('/protected').status_code != 200
+
+    with cache_app.app_context():
+        user = AppUser.query.filter_by(username='cacheuser').first()
+        cache_app.datastore.activate_user(user)
+        db.session.commit()
+    assert logged_in_client.get('/protected').status_code == 200
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+import inference
+from inference import InferenceExecutor
+
+
+@pytest.fixture(params=[False, True], ids=['threads', 'gevent'])
+def gevent_active(request, monkeypatch):
+    monkeypatch.setattr(inference, '_gevent_is_active', lambda: request.param)
+    return request.param
+
+
+@pytest.fixture
+def executor(gevent_active):
+    return InferenceExecutor(max_workers=2)
+
+
+def call_concurrently(gevent_active, func, count):
+    """Call ``func`` from ``count`` greenlets under gevent, or from as many threads otherwise."""
+    if gevent_active:
+        import gevent
+        return [greenlet.value for greenlet in gevent.joinall([gevent.spawn(func) for _ in range(count)])]
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(func())) for _ in range(count)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    return results
+
+
+def test_run_returns_result(executor):
+    assert executor.run(lambda a, b=0: a + b, 2, b=3) == 5
+
+
+def test_run_reraises_exceptions(executor):
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError, match='boom'):
+        executor.run(fail)
+
+
+def test_run_limits_concurrent_threads(executor, gevent_active):
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return threading.get_ident()
+
+    results = call_concurrently(gevent_active, lambda: executor.run(work), 6)
+
+    assert len(results) == 6
+    assert max(peak) <= 2
+    assert len(set(results)) <= 2
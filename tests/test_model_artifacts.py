@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import pytest
+
+from model_artifacts import ModelArtifactError, ModelArtifactManager, load_manifest, pinned_digest
+
+BUCKET_NAME = 'test-models'
+PAYLOAD = os.urandom(300 * 1024 + 17)
+
+
+@pytest.fixture
+def bucket_name():
+    return BUCKET_NAME
+
+
+@pytest.fixture
+def s3_client(s3_client):
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='model.pth', Body=PAYLOAD)
+    return s3_client
+
+
+def make_manager(s3_client, cache_dir, sha256, allow_unpinned=False):
+    manifest = {'test_model': {'version': 'v1', 'model_type': 'vit_b', 'key': 'model.pth', 'sha256': sha256}}
+    return ModelArtifactManager(s3_client, BUCKET_NAME, str(cache_dir), manifest, workers=4, chunk_size=64 * 1024,
+                                allow_unpinned=allow_unpinned)
+
+
+def test_parallel_download_is_verified_and_cached(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, hashlib.sha256(PAYLOAD).hexdigest())
+    path = manager.ensure('test_model')
+    assert path == os.path.join(str(tmp_path), 'test_model', 'v1', 'model.pth')
+    with open(path, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key='model.pth')
+    assert manager.ensure('test_model') == path
+
+
+def test_checksum_mismatch_leaves_no_artifact(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, '0' * 64)
+    with pytest.raises(ModelArtifactError):
+        manager.ensure('test_model')
+    assert os.listdir(os.path.join(str(tmp_path), 'test_model', 'v1')) == ['model.pth.lock']
+
+
+def test_partial_file_is_replaced(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, hashlib.sha256(PAYLOAD).hexdigest())
+    path = manager.local_path('test_model')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(PAYLOAD[:1000])
+
+    manager.ensure('test_model')
+    with open(path, 'rb') as f:
+        assert f.read() == PAYLOAD
+
+
+def test_md5_pin_is_verified_when_no_sha256_is_pinned(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, None)
+    manager.manifest['test_model']['md5'] = hashlib.md5(PAYLOAD).hexdigest()
+    path = manager.ensure('test_model')
+    with open(f"{path}.verified") as f:
+        assert f.read() == hashlib.md5(PAYLOAD).hexdigest()
+
+    manager.manifest['test_model']['md5'] = '0' * 32
+    os.remove(f"{path}.verified")
+    with pytest.raises(ModelArtifactError, match='Checksum mismatch'):
+        manager.ensure('test_model')
+
+
+def test_shipped_manifest_pins_every_model():
+    manifest = load_manifest(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'model_manifest.json'))
+    assert all(pinned_digest(entry)[1] for entry in manifest.values())
+
+
+def test_unpinned_model_is_refused(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, None)
+    with pytest.raises(ModelArtifactError, match='No checksum pinned'):
+        manager.ensure('test_model')
+
+
+def test_allowed_unpinned_model_is_never_marked_verified(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, None, allow_unpinned=True)
+    path = manager.ensure('test_model')
+    assert not os.path.exists(f"{path}.verified")
+
+    # Not trusted from the cache, so it is fetched again
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key='model.pth')
+    with pytest.raises(Exception):
+        manager.ensure('test_model')
+
+
+def test_short_download_is_rejected(s3_client, tmp_path, monkeypatch):
+    manager = make_manager(s3_client, tmp_path, hashlib.sha256(PAYLOAD).hexdigest())
+    monkeypatch.setattr(manager, '_download_range', lambda key, fd, start, end: 0)
+    with pytest.raises(ModelArtifactError, match='Downloaded 0 bytes'):
+        manager.ensure('test_model')
+
+
+def test_size_comes_from_manifest_or_s3_without_downloading(s3_client, tmp_path):
+    manager = make_manager(s3_client, tmp_path, hashlib.sha256(PAYLOAD).hexdigest())
+    assert manager.size('test_model') == len(PAYLOAD)
+    assert not os.path.exists(manager.local_path('test_model'))
+
+    manager.manifest['test_model']['size'] = 123
+    assert manager.size('test_model') == 123
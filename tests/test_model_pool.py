@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from model_pool import ModelPool, ModelPoolExhausted, ModelTooLarge
+
+SIZES = {'small': 10, 'medium': 20, 'other': 20, 'large': 40}
+
+
+def make_pool(memory_budget, wait_timeout=1):
+    loaded = []
+
+    def loader(name):
+        loaded.append(name)
+        return f"model:{name}", SIZES[name]
+
+    return ModelPool(loader, SIZES.__getitem__, memory_budget, wait_timeout=wait_timeout), loaded
+
+
+def test_loads_on_demand_and_reuses_resident_model():
+    pool, loaded = make_pool(memory_budget=100)
+    with pool.acquire('small') as model:
+        assert model == 'model:small'
+    with pool.acquire('small'):
+        pass
+    assert loaded == ['small']
+
+
+def test_evicts_least_recently_used_idle_model():
+    pool, loaded = make_pool(memory_budget=40)
+    with pool.acquire('small'):
+        pass
+    with pool.acquire('medium'):
+        pass
+    with pool.acquire('small'):
+        pass
+    with pool.acquire('large'):
+        pass
+    assert set(pool.stats()['resident']) == {'large'}
+    assert pool.stats()['evictions'] == 2
+
+    pool, loaded = make_pool(memory_budget=40)
+    for name in ['small', 'medium', 'small', 'other']:
+        with pool.acquire(name):
+            pass
+    assert list(pool.stats()['resident']) == ['small', 'other']
+
+
+def test_model_in_use_is_never_evicted():
+    pool, loaded = make_pool(memory_budget=40, wait_timeout=0.05)
+    with pool.acquire('medium'):
+        with pytest.raises(ModelPoolExhausted):
+            with pool.acquire('large'):
+                pass
+        assert 'medium' in pool.stats()['resident']
+
+
+def test_waits_for_release_then_loads():
+    pool, loaded = make_pool(memory_budget=40, wait_timeout=5)
+    acquired = threading.Event()
+
+    def load_large():
+        with pool.acquire('large'):
+            acquired.set()
+
+    with pool.acquire('medium'):
+        thread = threading.Thread(target=load_large)
+        thread.start()
+        assert not acquired.wait(0.1)
+    thread.join(5)
+    assert acquired.is_set()
+    assert loaded == ['medium', 'large']
+
+
+def test_model_larger_than_budget_is_rejected():
+    pool, loaded = make_pool(memory_budget=30)
+    with pytest.raises(ModelTooLarge):
+        with pool.acquire('large'):
+            pass
+    assert loaded == []
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Image, ImageSegment, ImageArchive, ImageSegmentArchive, create_db_app
+from reaper import purge_deleted_images, sweep_orphaned_files, archive_deleted_images
+
+BUCKET_NAME = 'test-images'
+
+
+@pytest.fixture
+def reaper_app():
+    app = create_db_app('config.TestConfig', SQLALCHEMY_DATABASE_URI='sqlite://')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def bucket_name():
+    return BUCKET_NAME
+
+
+def add_image(s3_client, name, active=True, deleted_at=None):
+    filepath = f"images/uploads/{name}.jpg"
+    segment_path = f"images/segments/combined-{name}.jpg"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=filepath, Body=b'original')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=segment_path, Body=b'segment')
+    image = Image(filename=f"{name}.jpg", filepath=filepath, active=active, deleted_at=deleted_at)
+    db.session.add(image)
+    db.session.flush()
+    db.session.add(ImageSegment(image_id=image.id, processed_filename=segment_path, num_segments=3))
+    db.session.commit()
+    return image
+
+
+def keys(s3_client):
+    return sorted(obj['Key'] for obj in s3_client.list_objects_v2(Bucket=BUCKET_NAME).get('Contents', []))
+
+
+def test_purge_deletes_files_of_deleted_images_only(reaper_app, s3_client):
+    add_image(s3_client, 'kept')
+    deleted = add_image(s3_client, 'deleted', active=False, deleted_at=datetime.utcnow())
+
+    assert purge_deleted_images(s3_client, BUCKET_NAME) == 1
+    assert keys(s3_client) == ['images/segments/combined-kept.jpg', 'images/uploads/kept.jpg']
+    assert db.session.get(Image, deleted.id).purged_at is not None
+    assert purge_deleted_images(s3_client, BUCKET_NAME) == 0
+
+
+def test_failed_deletes_leave_image_unpurged(reaper_app, s3_client, monkeypatch):
+    deleted = add_image(s3_client, 'deleted', active=False, deleted_at=datetime.utcnow())
+    monkeypatch.setattr('reaper.delete_files_from_s3', lambda client, filenames, bucket: list(filenames))
+
+    assert purge_deleted_images(s3_client, BUCKET_NAME, attempts=2, backoff=0) == 0
+    assert db.session.get(Image, deleted.id).purged_at is None
+
+
+def test_sweep_removes_unreferenced_files_after_grace_period(reaper_app, s3_client):
+    add_image(s3_client, 'kept')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='images/segments/combined-orphan.jpg', Body=b'orphan')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='ai_model/model.pth', Body=b'model')
+    prefixes = ['images/uploads/', 'images/segments/']
+
+    assert sweep_orphaned_files(s3_client, BUCKET_NAME, prefixes) == 0
+    assert sweep_orphaned_files(s3_client, BUCKET_NAME, prefixes, grace_period=timedelta(seconds=-60)) == 1
+    assert keys(s3_client) == ['ai_model/model.pth', 'images/segments/combined-kept.jpg', 'images/uploads/kept.jpg']
+
+
+def test_archive_moves_old_purged_images(reaper_app, s3_client):
+    old = add_image(s3_client, 'old', active=False, deleted_at=datetime.utcnow() - timedelta(days=40))
+    recent = add_image(s3_client, 'recent', active=False, deleted_at=datetime.utcnow())
+    purge_deleted_images(s3_client, BUCKET_NAME)
+
+    assert archive_deleted_images(older_than=timedelta(days=30)) == 1
+    assert [image.id for image in Image.query.all()] == [recent.id]
+    archive = ImageArchive.query.filter_by(original_id=old.id).one()
+    assert archive.filepath == 'images/uploads/old.jpg'
+    assert ImageSegmentArchive.query.filter_by(image_id=archive.id).count() == 1
+    assert ImageSegment.query.filter_by(image_id=old.id).count() == 0
+
+
+def test_archive_keeps_images_whose_ids_were_reused(reaper_app, s3_client):
+    long_ago = datetime.utcnow() - timedelta(days=40)
+    first = add_image(s3_client, 'first', active=False, deleted_at=long_ago)
+    purge_deleted_images(s3_client, BUCKET_NAME)
+    assert archive_deleted_images() == 1
+
+    # SQLite gives the next image the id of the archived one
+    second = add_image(s3_client, 'second', active=False, deleted_at=long_ago)
+    assert second.id == first.id
+    purge_deleted_images(s3_client, BUCKET_NAME)
+    assert archive_deleted_images() == 1
+
+    archives = ImageArchive.query.filter_by(original_id=first.id).order_by(ImageArchive.id).all()
+    assert [archive.filename for archive in archives] == ['first.jpg', 'second.jpg']
+    assert ImageSegmentArchive.query.count() == 2
+
+
+def test_reaper_app_uses_in_memory_database(reaper_app):
+    assert str(db.engine.url) == 'sqlite://'
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from utils import (
+    create_segmentation_layer, create_rgba_image, combine_two_images, create_label_overlay, encode_label_overlay,
+    decode_label_overlay, composite_filename, is_composite_at, opacity_percent
+)
+
+
+def make_masks(shape):
+    large = np.zeros(shape, dtype=bool)
+    large[:, :30] = True
+    small = np.zeros(shape, dtype=bool)
+    small[10:20, 10:20] = True
+    return [{'segmentation': small, 'area': int(small.sum())}, {'segmentation': large, 'area': int(large.sum())}]
+
+
+def test_label_overlay_paints_smaller_masks_on_top():
+    masks = make_masks((40, 50))
+    labels, palette = create_label_overlay(masks, (40, 50, 3))
+
+    assert labels.dtype == np.uint8
+    assert palette.shape == (3, 3)
+    assert labels[15, 15] == 2
+    assert labels[0, 0] == 1
+    assert labels[0, 40] == 0
+
+
+@pytest.mark.parametrize('image_format', ['PNG', 'WEBP'])
+def test_overlay_round_trip_reproduces_composite(image_format):
+    np.random.seed(0)
+    shape = (40, 50)
+    masks = make_masks(shape)
+    original = np.random.randint(0, 256, shape + (3,), dtype=np.uint8)
+    labels, palette = create_label_overlay(masks, original.shape)
+
+    layer = decode_label_overlay(encode_label_overlay(labels, palette, image_format).getvalue())
+
+    expected = np.zeros(shape + (4,), dtype=np.uint8)
+    expected[labels > 0, :3] = palette[labels[labels > 0]]
+    expected[labels > 0, 3] = 255
+    np.testing.assert_array_equal(layer, expected)
+    composite = combine_two_images(create_rgba_image(original), layer, alpha=0.5)
+    assert composite.shape == shape + (4,)
+
+
+def test_overlay_is_smaller_than_dense_layer():
+    shape = (200, 200)
+    masks = make_masks(shape)
+    labels, palette = create_label_overlay(masks, shape + (3,))
+
+    dense = create_segmentation_layer(masks, np.zeros(shape + (3,), dtype=np.uint8))
+    assert len(encode_label_overlay(labels, palette).getvalue()) < dense.nbytes / 100
+
+
+def test_nearby_opacities_get_different_composite_keys():
+    keys = [composite_filename('images/segments/', 7, opacity_percent(opacity))
+            for opacity in ('0.28', '0.29', 0.57, 0.58)]
+    assert keys[:2] == ['images/segments/composite-7-28.jpg', 'images/segments/composite-7-29.jpg']
+    assert len(set(keys)) == 4
+
+
+@pytest.mark.parametrize('value', ['-0.1', '1.5', 'abc', 'nan', 'inf'])
+def test_invalid_opacity_is_rejected(value):
+    with pytest.raises(ValueError):
+        opacity_percent(value)
+
+
+def test_stored_composite_is_only_reused_at_its_own_opacity():
+    folder = 'images/segments/'
+    assert is_composite_at('images/segments/composite-7-30.jpg', folder, 7, 30)
+    assert not is_composite_at('images/segments/composite-7-30.jpg', folder, 7, 50)
+    assert not is_composite_at('images/segments/composite-8-30.jpg', folder, 7, 30)
+    # Legacy composites were blended at the old default of 30%
+    assert is_composite_at('images/segments/combined-2024-07-23T03:57:11.jpg', folder, 7, 30)
+    assert not is_composite_at('images/segments/combined-2024-07-23T03:57:11.jpg', folder, 7, 50)
+    assert not is_composite_at(None, folder, 7, 30)
@@ -1,7 +1,11 @@
-from typing import List, Dict, Any
+import os
+import struct
+from io import BytesIO
+from typing import List, Dict, Any, Optional, Tuple
 
 import cv2
 import numpy as np
+from PIL import Image as PILImage
 
 
 def create_segmentation_layer(masks: List[Dict[str, Any]], original_image: np.ndarray) -> np.ndarray:
@@ -31,7 +35,121 @@ def create_rgba_image(rgb_image: np.ndarray) -> np.ndarray:
     return np.dstack((rgb_image, alpha_channel))
 
 
-def combine_two_images(image1: np.ndarray, image2: np.ndarray) -> np.ndarray:
-    """Combine two images."""
-    # add a dimension to image1
-    return cv2.addWeighted(image1, 0.7, image2, 0.3, 0)
+def combine_two_images(image1: np.ndarray, image2: np.ndarray, alpha: float = 0.3) -> np.ndarray:
+    """Combine two images, weighting the second one by alpha."""
+    return cv2.addWeighted(image1, 1 - alpha, image2, alpha, 0)
+
+
+def create_label_overlay(masks: List[Dict[str, Any]], shape: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """Create an 8-bit label map and its palette from the masks provided.
+
+    Label 0 is the transparent background. Masks are painted largest first so smaller segments stay
+    visible, as in create_segmentation_layer; only the 255 largest fit in the palette.
+    """
+    labels = np.zeros(shape[:2], dtype=np.uint8)
+    sorted_masks = sorted(masks, key=(lambda x: x['area']), reverse=True)[:255]
+
+    palette = np.zeros((len(sorted_masks) + 1, 3), dtype=np.uint8)
+    palette[1:] = np.random.randint(0, 256, (len(sorted_masks), 3))
+    for label, mask in enumerate(sorted_masks, start=1):
+        labels[mask['segmentation']] = label
+
+    return labels, palette
+
+
+def encode_label_overlay(labels: np.ndarray, palette: np.ndarray, image_format: str = 'PNG') -> BytesIO:
+    """Encode a label map as an indexed PNG (or lossless WebP) with label 0 transparent."""
+    image = PILImage.fromarray(labels, mode='P')
+    image.putpalette(palette.flatten().tolist())
+    image.info['transparency'] = 0
+    image_io = BytesIO()
+    if image_format.upper() == 'WEBP':
+        image.convert('RGBA').save(image_io, format='WEBP', lossless=True, exact=True)
+    else:
+        image.save(image_io, format='PNG', optimize=True, transparency=0)
+    image_io.seek(0)
+    return image_io
+
+
+def decode_label_overlay(data: bytes) -> np.ndarray:
+    """Decode an overlay written by encode_label_overlay into an RGBA layer like create_segmentation_layer's."""
+    rgba_image = np.array(PILImage.open(BytesIO(data)).convert('RGBA'))
+    rgba_image[rgba_image[:, :, 3] == 0] = 0
+    return rgba_image
+
+
+def render_composite(original: bytes, overlay: bytes, alpha: float = 0.3) -> bytes:
+    """Blend an overlay written by encode_label_overlay into its encoded original and return the JPEG bytes."""
+    original_image = cv2.imdecode(np.frombuffer(original, dtype=np.uint8), cv2.IMREAD_COLOR)
+    original_image_rgb = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
+    combined_image = combine_two_images(create_rgba_image(original_image_rgb), decode_label_overlay(overlay),
+                                        alpha=alpha)
+    _, img_encoded = cv2.imencode('.jpg', cv2.cvtColor(combined_image, cv2.COLOR_RGB2BGR))
+    return img_encoded.tobytes()
+
+
+def opacity_percent(value: Any) -> int:
+    """Convert an opacity between 0 and 1 to whole percent, raising ValueError when it is not one."""
+    opacity = float(value)
+    if not 0 <= opacity <= 1:
+        raise ValueError(f"opacity {value} is not between 0 and 1")
+    # round() rather than int(), since 0.29 * 100 is 28.999...
+    return round(opacity * 100)
+
+
+def composite_filename(folder: str, segment_id: int, opacity_percent: int) -> str:
+    """Return the S3 key of a composite rendered on demand at a whole-percent opacity."""
+    return os.path.join(folder, f"composite-{segment_id}-{opacity_percent}.jpg")
+
+
+def is_composite_at(processed_filename: Optional[str], folder: str, segment_id: int, opacity_percent: int) -> bool:
+    """Return whether a segment's stored composite was rendered at ``opacity_percent``.
+
+    Composites stored by apply_sam before overlays existed (``combined-*.jpg``) were blended at 30%.
+    """
+    if not processed_filename:
+        return False
+    if processed_filename == composite_filename(folder, segment_id, opacity_percent):
+        return True
+    name = os.path.basename(processed_filename)
+    return name.startswith('combined-') and name.endswith('.jpg') and opacity_percent == 30
+
+
+def read_image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read (height, width) from a PNG, JPEG or WebP header without decoding the pixels."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return height, width
+
+    if data[:2] == b'\xff\xd8':
+        i = 2
+        while i + 4 <= len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:  # fill byte
+                i += 1
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):  # start of frame
+                if i + 9 > len(data):
+                    return None
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return height, width
+            if 0xD0 <= marker <= 0xD9 or marker == 0x01:  # markers without a length
+                i += 2
+                continue
+            i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+        return None
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return height & 0x3FFF, width & 0x3FFF
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return ((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[27:30], 'little') + 1, int.from_bytes(data[24:27], 'little') + 1
+
+    return None